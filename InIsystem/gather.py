@@ -0,0 +1,180 @@
+""" Inverse-mapping (gather) elemental image array renderer """
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+from InIsystem.plan import lens_geometry
+from InIsystem.memory import worker_threads
+
+
+def ray_samples(L, P_L, P_I, g, steps=None):
+    """Depth samples used to march the ray of every elemental image pixel.
+
+    Args:
+        L     : Converted depth information.
+        P_L   : Size of elemental lens.
+        P_I   : Pixel size of the object image.
+        g     : Gap between lens and display.
+        steps : Number of samples. (default: one sample per object pixel swept)
+    Returns:
+        depths: Increasing depth samples from L.min() to L.max().
+    """
+    L_min, L_max = float(L.min()), float(L.max())
+    if steps is None:
+        # Inside a lens the ray sweeps at most P_L * (L_max - L_min) / (g * P_I) pixels.
+        steps = int(np.ceil(P_L * (L_max - L_min) / (g * P_I))) + 1
+    return np.linspace(L_min, L_max, max(steps, 1))
+
+
+def ray_indices(cells, size, depths, P_L, P_I, g, num_of_lenses):
+    """Object pixel crossed by the rays of EIA cells at every depth sample.
+
+    Separable: a column of the EIA only depends on 'x', a row only on 'y'.
+
+    Args:
+        cells         : EIA column (or row) indices.
+        size          : Width (or height) of the object image.
+        depths        : Depth samples of the rays.
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+        g             : Gap between lens and display.
+        num_of_lenses : Number of lenses of lens array.
+    Returns:
+        indices       : Object pixel indices, (len(depths), len(cells)). -1 outside the image.
+    """
+    elem_plane_w = num_of_lenses * P_L
+    half_elem = elem_plane_w // 2
+
+    lens_loc = lens_geometry(num_of_lenses, P_L)[0].astype(np.float64)
+    lens = np.minimum(np.asarray(cells) // P_L, num_of_lenses - 1)
+    center = P_L * lens_loc[lens]
+
+    # Inverse of 'points_transfrom' at the center of the cell.
+    u = np.asarray(cells) - half_elem + 0.5
+    coord = (center[None, :] + (center - u)[None, :] * depths[:, None] / g) / P_I
+
+    indices = np.floor(coord + int(size / 2) + 0.5).astype(np.int32)
+    indices[(indices < 0) | (indices >= size)] = -1
+    return indices
+
+
+def gather_cells(color, L, rows, cols, P_L, P_I, g, num_of_lenses, steps=None):
+    """Gather the object pixels seen by a grid of EIA cells.
+
+    Every cell casts a ray through its lens and marches it from the nearest
+    to the farthest depth of the scene. The first object pixel the ray
+    reaches or passes is the visible one, so the nearest surface (smallest L)
+    wins wherever several object pixels project to the same cell.
+
+    Args:
+        color         : Color image.
+        L             : Converted depth information.
+        rows          : EIA row indices.
+        cols          : EIA column indices.
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+        g             : Gap between lens and display.
+        num_of_lenses : Number of lenses of lens array.
+        steps         : Number of depth samples of each ray. (see ray_samples)
+    Returns:
+        src_rows      : Object pixel row of each cell, (len(rows), len(cols)). -1 if none.
+        src_cols      : Object pixel column of each cell, (len(rows), len(cols)). -1 if none.
+    """
+    height, width, _ = color.shape
+    depths = ray_samples(L, P_L, P_I, g, steps)
+    row_idx = ray_indices(rows, height, depths, P_L, P_I, g, num_of_lenses)
+    col_idx = ray_indices(cols, width, depths, P_L, P_I, g, num_of_lenses)
+
+    src_rows = np.full((len(rows), len(cols)), -1, dtype=np.int32)
+    src_cols = np.full((len(rows), len(cols)), -1, dtype=np.int32)
+    found = np.zeros((len(rows), len(cols)), dtype=bool)
+
+    for s, depth in enumerate(depths):
+        r = row_idx[s][:, None]
+        c = col_idx[s][None, :]
+        inside = (r >= 0) & (c >= 0)
+
+        hit = inside & ~found & (L[np.maximum(r, 0), np.maximum(c, 0)] <= depth)
+        src_rows[hit] = np.broadcast_to(r, hit.shape)[hit]
+        src_cols[hit] = np.broadcast_to(c, hit.shape)[hit]
+        found |= hit
+        if found.all():
+            break
+    return src_rows, src_cols
+
+
+def render_EIA_gather(color, L, P_L, P_I, g, num_of_lenses, steps=None, workers=None, plan=None):
+    """Render elemental image array by inverse mapping.
+
+    Deterministic and depth-ordered. Cells whose ray leaves the object image
+    or only meets dark pixels stay empty (mostly border lenses), so the
+    result is inpainted like the scatter renderers'.
+
+    Args:
+        color         : Color image.
+        L             : Converted depth information.
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+        g             : Gap between lens and display.
+        num_of_lenses : Number of lenses of lens array.
+        steps         : Number of depth samples of each ray. (see ray_samples)
+        workers       : Number of threads. (default: number of CPUs)
+        plan          : PickupPlan. (unused, the rays only need the cached lens geometry)
+    Returns:
+        EIA           : Elemental image array. (uint8)
+    """
+    workers = workers or worker_threads()
+    elem_plane_w = num_of_lenses * P_L
+    cols = np.arange(elem_plane_w)
+
+    # Bands of whole lens rows keep the per-step temporaries small.
+    bands = np.array_split(np.arange(elem_plane_w), max(elem_plane_w // (4 * P_L), 1))
+
+    EIA = np.zeros((elem_plane_w, elem_plane_w, 3), dtype=np.uint8)
+
+    def gather_band(band):
+        src_rows, src_cols = gather_cells(color, L, band, cols, P_L, P_I, g, num_of_lenses, steps)
+        found = src_rows >= 0
+        EIA[band[0]:band[-1] + 1][found] = color[src_rows[found], src_cols[found]]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(gather_band, bands))
+    return EIA
+
+
+def synthesize_views(color, L, P_L, P_I, g, num_of_lenses, rows, cols, steps=None, workers=None):
+    """Render sub-aperture views straight from the object image, without the EIA.
+
+    Pixel (a, b) of view (p, q) is the EIA cell (p + a * P_L, q + b * P_L),
+    so a view is the gather of one cell under every lens: a depth dependent
+    warp of the color image. The views are identical to the views of
+    'render_EIA_gather'.
+
+    Args:
+        color         : Color image.
+        L             : Converted depth information.
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+        g             : Gap between lens and display.
+        num_of_lenses : Number of lenses of lens array.
+        rows          : Row p of each view.
+        cols          : Column q of each view.
+        steps         : Number of depth samples of each ray. (see ray_samples)
+        workers       : Number of threads. (default: number of CPUs)
+    Returns:
+        views         : Sub-aperture image stack, (number of views, num_of_lenses, num_of_lenses, 3). (uint8)
+    """
+    workers = workers or worker_threads()
+    lenses = np.arange(num_of_lenses) * P_L
+    views = np.zeros((len(rows), num_of_lenses, num_of_lenses, 3), dtype=np.uint8)
+
+    def synthesize_view(k):
+        src_rows, src_cols = gather_cells(color, L, rows[k] + lenses, cols[k] + lenses,
+                                          P_L, P_I, g, num_of_lenses, steps)
+        found = src_rows >= 0
+        views[k][found] = color[src_rows[found], src_cols[found]]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(synthesize_view, range(len(rows))))
+    return views
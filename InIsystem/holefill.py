@@ -0,0 +1,88 @@
+""" Hole filling methods for elemental / sub-aperture images """
+
+import cv2
+import numpy as np
+
+
+def inpaint_NS(images, masks, radius):
+    """Fill holes with OpenCV Navier-Stokes inpainting, one image at a time.
+
+    Args:
+        images : Image stack, (batch, height, width, 3). (uint8)
+        masks  : Hole masks, (batch, height, width). (bool)
+        radius : Inpainting radius.
+    Returns:
+        filled : Inpainted image stack.
+    """
+    filled = np.empty_like(images)
+    for k in range(len(images)):
+        mask = masks[k].astype(np.uint8) * 255
+        filled[k] = cv2.inpaint(np.ascontiguousarray(images[k]), mask, radius, cv2.INPAINT_NS)
+    return filled
+
+
+def pull_push(images, masks):
+    """Fill holes with a pull-push pyramid, for a whole stack at once.
+
+    Pull: known pixels are averaged 2x2 level by level (weights clipped to 1).
+    Push: going back down, every pixel is blended with the coarser level
+    according to its missing weight. Known pixels are left untouched.
+
+    Args:
+        images : Image stack, (batch, height, width, channels).
+        masks  : Hole masks, (batch, height, width). (bool)
+    Returns:
+        filled : Filled image stack, same dtype as images.
+    """
+    weight = (~masks).astype(np.float32)[..., None]
+    color = images.astype(np.float32) * weight
+
+    # Pull: premultiplied color and weight of every pyramid level.
+    levels = [(color, weight)]
+    while max(color.shape[1], color.shape[2]) > 1:
+        pad = ((0, 0), (0, color.shape[1] % 2), (0, color.shape[2] % 2), (0, 0))
+        color = np.pad(color, pad)
+        weight = np.pad(weight, pad)
+
+        color = color[:, 0::2, 0::2] + color[:, 1::2, 0::2] + color[:, 0::2, 1::2] + color[:, 1::2, 1::2]
+        weight = weight[:, 0::2, 0::2] + weight[:, 1::2, 0::2] + weight[:, 0::2, 1::2] + weight[:, 1::2, 1::2]
+
+        scale = np.where(weight > 1, 1 / np.maximum(weight, 1), 1)
+        color *= scale
+        weight = np.minimum(weight, 1)
+        levels.append((color, weight))
+
+    # Push: fill each level with the (upsampled) coarser one.
+    color, weight = levels[-1]
+    filled = color / np.maximum(weight, 1e-6)
+    for color, weight in reversed(levels[:-1]):
+        height, width = color.shape[1:3]
+        coarse = filled.repeat(2, axis=1).repeat(2, axis=2)[:, :height, :width]
+        filled = color + (1 - weight) * coarse
+
+    filled = np.where(masks[..., None], filled, images)
+    if np.issubdtype(images.dtype, np.integer):
+        filled = np.clip(np.rint(filled), 0, np.iinfo(images.dtype).max)
+    return filled.astype(images.dtype)
+
+
+METHODS = ['ns', 'pullpush']
+
+
+def fill_holes(images, masks, method='ns', radius=5):
+    """Fill the holes of an image stack.
+
+    Args:
+        images : Image stack, (batch, height, width, 3).
+        masks  : Hole masks, (batch, height, width). (bool)
+        method : 'ns' (cv2 Navier-Stokes, uint8 only) or 'pullpush' (whole-stack NumPy).
+        radius : Inpainting radius for 'ns'.
+    Returns:
+        filled : Filled image stack.
+    """
+    if method == 'ns':
+        return inpaint_NS(images, masks, radius)
+    if method == 'pullpush':
+        return pull_push(images, masks)
+    raise ValueError('Unknown hole filling method: {} (expected one of {})'.format(
+        method, ', '.join(METHODS)))
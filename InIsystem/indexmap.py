@@ -0,0 +1,122 @@
+""" Reusable object pixel to EIA cell index map """
+
+import json
+import hashlib
+import numpy as np
+
+from InIsystem.pickup import scatter_bands
+from InIsystem.subaperture import parse_views
+
+
+def geometry_digest(L, P_L, P_I, g, num_of_lenses):
+    """Fingerprint of the inputs of the pickup geometry: the converted depth and the lens parameters."""
+    L = np.ascontiguousarray(L, dtype=np.float32)
+    sha = hashlib.sha256(str((L.shape, P_L, float(P_I), float(g), num_of_lenses)).encode())
+    sha.update(L.data)
+    return sha.hexdigest()
+
+
+class IndexMap():
+    """Object pixel seen by every EIA cell, for one depth map.
+
+    The pickup geometry only depends on the converted depth, so the map is
+    computed once and applied to any number of channels (RGB, depth, alpha,
+    ...) and to every later frame with the same depth, in one indexing step.
+    It holds one int32 per EIA cell: the flat object pixel index, read by
+    the rule of the CUDA kernel (see plan.source_index), -1 for a hole.
+    Collisions resolve like 'pickup.render_EIA_CPU' (last object pixel in
+    raster order wins), so applying the map to the color image gives the
+    same EIA.
+
+    Args:
+        src           : Object pixel of each EIA cell, (elem_plane_w * elem_plane_w,). (int32)
+        num_of_lenses : Number of lenses of lens array.
+        P_L           : Size of elemental lens.
+        source_shape  : (height, width) of the object image.
+        key           : geometry_digest of the depth map and lens parameters. (None: unknown)
+    """
+    def __init__(self, src, num_of_lenses, P_L, source_shape, key=None):
+        self.src = src
+        self.num_of_lenses = num_of_lenses
+        self.P_L = P_L
+        self.elem_plane_w = num_of_lenses * P_L
+        self.source_shape = tuple(source_shape)
+        self.key = key
+
+    @classmethod
+    def build(cls, L, P_L, P_I, g, num_of_lenses, workers=None, plan=None, band_size=16384):
+        """Run the pickup geometry once. (see pickup.scatter_bands for the arguments)"""
+        elem_plane_w = num_of_lenses * P_L
+        src_map = np.full(elem_plane_w * elem_plane_w, -1, dtype=np.int32)
+        for dst, src in scatter_bands(L, P_L, P_I, g, num_of_lenses, workers, plan, band_size):
+            src_map[dst] = src
+        return cls(src_map, num_of_lenses, P_L, L.shape[:2], geometry_digest(L, P_L, P_I, g, num_of_lenses))
+
+    def matches(self, L, P_L, P_I, g, num_of_lenses):
+        """True if the map was built for this depth map and these lens parameters."""
+        return self.key is not None and self.key == geometry_digest(L, P_L, P_I, g, num_of_lenses)
+
+    @property
+    def holes(self):
+        """EIA cells seen by no object pixel, (elem_plane_w, elem_plane_w)."""
+        return (self.src < 0).reshape(self.elem_plane_w, self.elem_plane_w)
+
+    def gather(self, values, src, fill=0):
+        # Values of the object pixels 'src', 'fill' where src is -1.
+        values = np.asarray(values)
+        if values.shape[:2] != self.source_shape:
+            raise ValueError('Values of shape {} do not match the object image {}'.format(
+                values.shape[:2], self.source_shape))
+        flat = values.reshape((-1,) + values.shape[2:])
+
+        out = flat[np.maximum(src, 0)]
+        out[src < 0] = fill
+        return out
+
+    def apply(self, values, fill=0):
+        """Elemental image array of any per-pixel values.
+
+        Args:
+            values : Object image values, (height, width) or (height, width, channels), any dtype.
+            fill   : Value of the holes.
+        Returns:
+            EIA    : (elem_plane_w, elem_plane_w) or (elem_plane_w, elem_plane_w, channels), dtype of values.
+        """
+        out = self.gather(values, self.src, fill)
+        return out.reshape((self.elem_plane_w, self.elem_plane_w) + out.shape[1:])
+
+    def sub_apertures(self, values, views=None, fill=0):
+        """Sub-aperture views of any per-pixel values, without building their EIA.
+
+        Args:
+            values : Object image values, (height, width) or (height, width, channels), any dtype.
+            views  : Selected views. (see subaperture.parse_views, default: every view)
+            fill   : Value of the holes.
+        Returns:
+            views  : Stack of views, (number of views, num_of_lenses, num_of_lenses[, channels]).
+        """
+        rows, cols, _ = parse_views(self.P_L, views)
+        lenses = np.arange(self.num_of_lenses) * self.P_L
+        cells = ((rows[:, None, None] + lenses[None, :, None]) * self.elem_plane_w +
+                 cols[:, None, None] + lenses[None, None, :])
+        return self.gather(values, self.src[cells], fill)
+
+    def save(self, path):
+        """Write the map to a '.npz' file."""
+        meta = {'num_of_lenses': self.num_of_lenses, 'P_L': self.P_L,
+                'source_shape': list(self.source_shape), 'key': self.key}
+        np.savez(path, src=self.src, meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path):
+        """Read a map written by 'save'."""
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            return cls(data['src'], meta['num_of_lenses'], meta['P_L'], meta['source_shape'], meta['key'])
+
+
+def get_index_map(index_map, L, P_L, P_I, g, num_of_lenses, **kwargs):
+    """Return 'index_map' if it was built for this depth map, else build one."""
+    if index_map is not None and index_map.matches(L, P_L, P_I, g, num_of_lenses):
+        return index_map
+    return IndexMap.build(L, P_L, P_I, g, num_of_lenses, **kwargs)
@@ -0,0 +1,141 @@
+""" Peak memory estimation, budget check and measurement of the pickup """
+
+import os
+import sys
+import resource
+
+
+MB = 1 << 20
+
+# Resident memory of a worker before any array is allocated (NumPy, OpenCV, ...).
+BASELINE_BYTES = 100 * MB
+
+
+def peak_rss():
+    """Peak resident set size of the current process, in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss():
+    """Current resident set size of the current process, in bytes. (peak if unavailable)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+def worker_threads():
+    """Number of threads of the pool of a pickup worker: the CPUs this process may run on."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+def estimate_pickup_memory(tile_shape, num_of_lenses, P_L, backend='cpu', fill_method='ns',
+                           num_of_views=None, workers=None, band_size=16384, chunk_pixels=1 << 20):
+    """Estimate the memory used by one pickup worker, stage by stage.
+
+    Pixels are uint8 and geometry float32 throughout the pipeline, the
+    estimate counts the arrays alive at the peak of each stage.
+
+    Args:
+        tile_shape    : (height, width) of the tile.
+        num_of_lenses : Number of lenses of lens array.
+        P_L           : Size of elemental lens.
+        backend       : Elemental image renderer.
+        fill_method   : Hole filling method.
+        num_of_views  : Number of extracted sub-aperture views. (default: P_L * P_L)
+        workers       : Number of threads of a worker. (default: worker_threads())
+        band_size     : Object pixels per task of the CPU renderer.
+        chunk_pixels  : Sub-aperture pixels filled at once by whole-stack methods.
+    Returns:
+        estimate      : Bytes per stage ('input', 'render', 'inpaint', 'sub_apertures') and 'peak'.
+                        ('direct' builds no EIA and has no 'inpaint' stage)
+    """
+    height, width = tile_shape[:2]
+    workers = workers or worker_threads()
+    num_of_views = P_L * P_L if num_of_views is None else num_of_views
+
+    pixels = height * width
+    cells = (num_of_lenses * P_L) ** 2
+    EIA = cells * 3
+
+    # color (uint8), depth and L (float64), plan coordinates (float32) and color indices (int32).
+    inputs = pixels * (3 + 8 + 8 + 2 * 4 + 4)
+
+    if backend == 'gpu':
+        # float32 download buffer.
+        render = EIA + cells * 4
+    elif backend == 'gather':
+        # Per band of 4 lens rows: ray indices, hit masks and gathered depth.
+        render = EIA + workers * 4 * P_L * num_of_lenses * P_L * (4 + 4 + 1 + 1 + 8)
+    elif backend == 'layered':
+        # Per band of 4 lens rows: hit mask of a plane and the indices of its hits.
+        render = EIA + workers * 4 * P_L * num_of_lenses * P_L * (1 + 8 + 8)
+    else:
+        # Writes of the bands in flight (one per thread plus the one being applied, see
+        # pickup.scatter_bands): about 100 per object pixel, ~48 bytes each with the lens
+        # footprint temporaries, sorting and concatenation.
+        render = EIA + (workers + 1) * band_size * 100 * 48
+
+    # Copy of the EIA, gray image and hole mask, and the batches being filled.
+    batch = 256 if fill_method == 'ns' else 4096
+    inpaint = 2 * EIA + 3 * cells + workers * batch * P_L * P_L * 3 * (1 if fill_method == 'ns' else 4 * 4)
+
+    views = num_of_views * num_of_lenses * num_of_lenses * 3
+    # float32 pull-push pyramid of a chunk of views for whole-stack methods.
+    pyramid = 0 if fill_method == 'ns' else chunk_pixels * 3 * 4 * 6
+    if backend == 'direct':
+        # No EIA: per view in flight, the gather temporaries of num_of_lenses^2 cells.
+        render = views + workers * num_of_lenses * num_of_lenses * (4 + 4 + 1 + 1 + 8)
+        estimate = {'input': inputs, 'render': inputs + render, 'sub_apertures': inputs + 3 * views + pyramid}
+        estimate['peak'] = BASELINE_BYTES + max(estimate.values())
+        return estimate
+
+    # EIA, gathered views, filled views and their final mosaic, plus the pyramid.
+    sub_apertures = EIA + 3 * views + pyramid
+
+    estimate = {
+        'input': inputs,
+        'render': inputs + render,
+        'inpaint': inputs + inpaint,
+        'sub_apertures': inputs + sub_apertures,
+    }
+    estimate['peak'] = BASELINE_BYTES + max(estimate.values())
+    return estimate
+
+
+def check_memory_budget(estimate, budget):
+    """Fail early if a worker would exceed its memory budget.
+
+    Args:
+        estimate : Result of estimate_pickup_memory.
+        budget   : Budget in bytes. (None: no budget)
+    """
+    if budget is not None and estimate['peak'] > budget:
+        stages = ', '.join('{}: {:.0f} MB'.format(k, v / MB) for k, v in estimate.items())
+        raise MemoryError('Pickup worker needs about {:.0f} MB, over the budget of {:.0f} MB ({})'.format(
+            estimate['peak'] / MB, budget / MB, stages))
+
+
+class StageMemory():
+    """Peak RSS of a process measured at the end of each stage.
+
+    ru_maxrss never decreases, so the value recorded for a stage is the peak
+    reached so far, and 'increase' is what the stage added to it.
+    """
+    def __init__(self):
+        self.stages = []
+        self.last = peak_rss()
+
+    def record(self, stage):
+        peak = peak_rss()
+        self.stages.append({'stage': stage, 'peak_rss': peak, 'increase': peak - self.last})
+        self.last = peak
+
+    def report(self, name=''):
+        return '\n'.join('{}{:<14s} peak RSS {:7.0f} MB (+{:.0f} MB)'.format(
+            name, s['stage'], s['peak_rss'] / MB, s['increase'] / MB) for s in self.stages)
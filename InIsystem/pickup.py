@@ -1,16 +1,17 @@
 """ Integral Imaing Pickup System """
 
-import os
-import cv2
+import collections
 import numpy as np
 
 from PIL import Image
-
-import pycuda.driver as cuda
-import pycuda.autoinit
-from pycuda.compiler import SourceModule
+from concurrent.futures import ThreadPoolExecutor
 
 import utils
+import InIsystem.gather as gather
+import InIsystem.layered as layered
+import InIsystem.holefill as holefill
+from InIsystem.plan import lens_geometry, get_plan, source_index
+from InIsystem.memory import worker_threads
 
 
 def generate_object_coords(color, L):
@@ -27,43 +28,6 @@ def generate_object_coords(color, L):
     return coords
 
 
-def generate_virtual_lens(num_of_lenses, P_L):
-    """Generate virtual lens array.
-
-    Args:
-        num_of_lens : Number of lenses of lens array.
-        P_L         : Size of elemental lens.
-    Returns:
-        lenses_idx  : Indices of virtual lenses.
-        lenses_loc  : Location of each lenses.
-    """
-    lenses_idx = []
-    for i_L in range(num_of_lenses):
-        for j_L in range(num_of_lenses):
-            lenses_idx.append((i_L, j_L))
-
-    lenses_loc = utils.generate_coords(num_of_lenses, num_of_lenses)
-    return lenses_idx, lenses_loc
-
-
-def generate_elemental_plane(num_of_lenses, P_L):
-    """Generate elemental image plane.
-
-    Args:
-        num_of_lenses : Number of lenses of lens array.
-        P_L           : Size of elemental lens.
-    Returns:
-        elem_plane    : Elemental image plane.
-        elem_coords   : Coordinates of elemental image.
-    """
-    elem_plane_h = P_L * num_of_lenses
-    elem_plane_w = P_L * num_of_lenses
-
-    elem_plane = np.zeros((elem_plane_h, elem_plane_w, 3))
-    elem_coords = utils.generate_coords(elem_plane_h, elem_plane_h)
-    return elem_plane, elem_coords
-
-
 def points_transfrom(i, j, i_L, j_L, P_L, P_I, g, L):
     """Transform points of object pixels to elemental image pixels.
 
@@ -85,8 +49,59 @@ def points_transfrom(i, j, i_L, j_L, P_L, P_I, g, L):
     return u, v
 
 
-def generate_elemental_imgs_GPU(color, L, P_L, P_I, g, num_of_lenses):
-    """Generate elemental images by paper's method.
+def lens_footprint(coord, L, P_L, P_I, g, num_of_lenses):
+    """Range of lenses (along one axis) whose window a pixel can land in.
+
+    For a fixed pixel and depth, 'points_transfrom' is linear in the lens
+    location, and so are the lens windows [lens_min, lens_min + P_L]. Solving
+    both inequalities for the lens index gives a closed interval, widened by
+    one lens on each side to absorb float32 rounding. Callers still apply the
+    exact window test to every lens of the range.
+
+    Args:
+        coord         : x (or y) coordinates of object pixels.
+        L             : Converted depth of object pixels.
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+        g             : Gap between lens and display.
+        num_of_lenses : Number of lenses of lens array.
+    Returns:
+        first         : First lens index of the range. (int32)
+        count         : Number of lenses of the range. (int32)
+    """
+    lens_loc, lens_min = lens_geometry(num_of_lenses, P_L)
+    lens_loc = lens_loc.astype(np.float64)
+    lens_min = lens_min.astype(np.float64)
+
+    ratio = g / np.asarray(L, dtype=np.float64)
+    step_loc = lens_loc[1] - lens_loc[0] if num_of_lenses > 1 else 1.
+    step_min = lens_min[1] - lens_min[0] if num_of_lenses > 1 else float(P_L)
+
+    # u(k) - lens_min(k) = offset + slope * k, must lie in [0, P_L].
+    offset = P_L * lens_loc[0] * (1 + ratio) - coord * P_I * ratio - lens_min[0]
+    slope = P_L * step_loc * (1 + ratio) - step_min
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lower = np.floor(-offset / slope) - 1
+        upper = np.ceil((P_L - offset) / slope) + 1
+
+    # Degenerate geometry (odd lens counts with large g / L): search every lens.
+    bounded = slope > 0
+    lower = np.where(bounded, lower, 0)
+    upper = np.where(bounded, upper, num_of_lenses - 1)
+
+    first = np.clip(lower, 0, num_of_lenses).astype(np.int32)
+    last = np.clip(upper, -1, num_of_lenses - 1).astype(np.int32)
+    count = np.maximum(last - first + 1, 0).astype(np.int32)
+    return first, count
+
+
+def render_EIA_reference(color, L, P_L, P_I, g, num_of_lenses, bounded=True):
+    """Pixel-by-pixel CPU reference renderer built on 'points_transfrom'.
+
+    Slow by design (one Python iteration per object pixel), meant to validate
+    the fast renderers on small inputs and to count the lens evaluations saved
+    by 'lens_footprint'.
 
     Args:
         color         : Color image.
@@ -95,32 +110,83 @@ def generate_elemental_imgs_GPU(color, L, P_L, P_I, g, num_of_lenses):
         P_I           : Pixel size of the object image.
         g             : Gap between lens and display.
         num_of_lenses : Number of lenses of lens array.
+        bounded       : Visit only the lenses of 'lens_footprint'.
+                        If False, every lens is visited like the original kernel.
     Returns:
-        elem_plane    : Elemental image array.
+        EIA           : Elemental image array. (uint8, not inpainted)
+        visits        : Number of evaluated (pixel, lens) pairs.
     """
     height, width, _ = color.shape
+    elem_plane_w = num_of_lenses * P_L
+    half_elem = elem_plane_w // 2
+
+    pixel_coords = generate_object_coords(color, L).astype(np.float32)
+    lens_loc, lens_min = lens_geometry(num_of_lenses, P_L)
+    colors = color.reshape(-1, 3)[source_index(pixel_coords[0], pixel_coords[1], height, width)]
+
+    first_x, count_x = lens_footprint(pixel_coords[0], pixel_coords[2], P_L, P_I, g, num_of_lenses)
+    first_y, count_y = lens_footprint(pixel_coords[1], pixel_coords[2], P_L, P_I, g, num_of_lenses)
+
+    EIA = np.zeros((elem_plane_w, elem_plane_w, 3), dtype=np.uint8)
+    visits = 0
+    for p_y in range(height):
+        for p_x in range(width):
+            if bounded:
+                i_L = np.arange(first_x[p_y, p_x], first_x[p_y, p_x] + count_x[p_y, p_x])
+                j_L = np.arange(first_y[p_y, p_x], first_y[p_y, p_x] + count_y[p_y, p_x])
+            else:
+                i_L = j_L = np.arange(num_of_lenses)
+            i_L, j_L = np.meshgrid(i_L, j_L, indexing='ij')
+            visits += i_L.size
+
+            x, y, depth = pixel_coords[:, p_y, p_x]
+            u, v = points_transfrom(x, y, lens_loc[i_L], lens_loc[j_L], np.float32(P_L),
+                                    np.float32(P_I), np.float32(g), depth)
+
+            hit = ((lens_min[i_L] <= u) & (u <= lens_min[i_L] + P_L) &
+                   (lens_min[j_L] <= v) & (v <= lens_min[j_L] + P_L))
+            col = (u[hit] + half_elem).astype(np.int32)
+            row = (v[hit] + half_elem).astype(np.int32)
+            inside = (0 <= col) & (col < elem_plane_w) & (0 <= row) & (row < elem_plane_w)
+            EIA[row[inside], col[inside]] = colors[p_y, p_x]
+    return EIA, visits
+
+
+def render_EIA_GPU(color, L, P_L, P_I, g, num_of_lenses, plan=None):
+    """Render elemental image array on the GPU (PyCUDA).
+
+    Args:
+        color         : Color image.
+        L             : Converted depth information.
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+        g             : Gap between lens and display.
+        num_of_lenses : Number of lenses of lens array.
+        plan          : PickupPlan of the tile shape. (built if None)
+    Returns:
+        EIA           : Elemental image array. (uint8, not inpainted)
+    """
+    # PyCUDA creates a CUDA context on import, keep it out of CPU-only hosts.
+    import pycuda.driver as cuda
+    import pycuda.autoinit
+    from pycuda.compiler import SourceModule
 
-    pixel_coords = generate_object_coords(color, L)
-    lenses_idx, lenses_loc= generate_virtual_lens(num_of_lenses, P_L)
-    elem_plane, elem_coords = generate_elemental_plane(num_of_lenses, P_L)
-    elem_plane_h, elem_plane_w, _ = elem_plane.shape
-    half_elem = elem_plane_h // 2
-    half_h = height // 2
-    half_w = width // 2
-
-    elem_plane_R = elem_plane[:, :, 0].astype(np.float32)
-    elem_plane_G = elem_plane[:, :, 1].astype(np.float32)
-    elem_plane_B = elem_plane[:, :, 2].astype(np.float32)
-    elem_plane_R_gpu = cuda.mem_alloc(elem_plane_R.nbytes)
-    elem_plane_G_gpu = cuda.mem_alloc(elem_plane_G.nbytes)
-    elem_plane_B_gpu = cuda.mem_alloc(elem_plane_B.nbytes)
-    cuda.memcpy_htod(elem_plane_R_gpu, elem_plane_R)
-    cuda.memcpy_htod(elem_plane_G_gpu, elem_plane_G)
-    cuda.memcpy_htod(elem_plane_B_gpu, elem_plane_B)
-
-    pixel_x = pixel_coords[0].astype(np.float32)
-    pixel_y = pixel_coords[1].astype(np.float32)
-    pixel_L = pixel_coords[2].astype(np.float32)
+    height, width, _ = color.shape
+    plan = get_plan(plan, color, P_L, P_I, num_of_lenses)
+    elem_plane_h = elem_plane_w = plan.elem_plane_w
+
+    # The elemental image plane only lives on the device, zeroed there.
+    plane_nbytes = elem_plane_h * elem_plane_w * np.dtype(np.float32).itemsize
+    elem_plane_R_gpu = cuda.mem_alloc(plane_nbytes)
+    elem_plane_G_gpu = cuda.mem_alloc(plane_nbytes)
+    elem_plane_B_gpu = cuda.mem_alloc(plane_nbytes)
+    cuda.memset_d32(elem_plane_R_gpu, 0, elem_plane_h * elem_plane_w)
+    cuda.memset_d32(elem_plane_G_gpu, 0, elem_plane_h * elem_plane_w)
+    cuda.memset_d32(elem_plane_B_gpu, 0, elem_plane_h * elem_plane_w)
+
+    pixel_x = plan.pixel_x
+    pixel_y = plan.pixel_y
+    pixel_L = np.ascontiguousarray(L, dtype=np.float32).ravel()
     pixel_x_gpu = cuda.mem_alloc(pixel_x.nbytes)
     pixel_y_gpu = cuda.mem_alloc(pixel_y.nbytes)
     pixel_L_gpu = cuda.mem_alloc(pixel_L.nbytes)
@@ -128,12 +194,10 @@ def generate_elemental_imgs_GPU(color, L, P_L, P_I, g, num_of_lenses):
     cuda.memcpy_htod(pixel_y_gpu, pixel_y)
     cuda.memcpy_htod(pixel_L_gpu, pixel_L)
 
-    lens_loc_x = lenses_loc[0].astype(np.float32)
-    lens_loc_y = lenses_loc[1].astype(np.float32)
-    lens_loc_x_gpu = cuda.mem_alloc(lens_loc_x.nbytes)
-    lens_loc_y_gpu = cuda.mem_alloc(lens_loc_y.nbytes)
-    cuda.memcpy_htod(lens_loc_x_gpu, lens_loc_x)
-    cuda.memcpy_htod(lens_loc_y_gpu, lens_loc_y)
+    lens_loc_gpu = cuda.mem_alloc(plan.lens_loc.nbytes)
+    lens_min_gpu = cuda.mem_alloc(plan.lens_min.nbytes)
+    cuda.memcpy_htod(lens_loc_gpu, plan.lens_loc)
+    cuda.memcpy_htod(lens_min_gpu, plan.lens_min)
 
     R = color[:, :, 0].astype(np.float32)
     G = color[:, :, 1].astype(np.float32)
@@ -145,19 +209,25 @@ def generate_elemental_imgs_GPU(color, L, P_L, P_I, g, num_of_lenses):
     cuda.memcpy_htod(G_gpu, G)
     cuda.memcpy_htod(B_gpu, B)
 
-    elem_coords_x = elem_coords[0].astype(np.float32)
-    elem_coords_y = elem_coords[1].astype(np.float32)
-    elem_coords_x_gpu = cuda.mem_alloc(elem_coords_x.nbytes)
-    elem_coords_y_gpu = cuda.mem_alloc(elem_coords_y.nbytes)
-    cuda.memcpy_htod(elem_coords_x_gpu, elem_coords_x)
-    cuda.memcpy_htod(elem_coords_y_gpu, elem_coords_y)
+    # Lenses which each object pixel can actually hit.
+    first_x, count_x = lens_footprint(pixel_x, pixel_L, P_L, P_I, g, num_of_lenses)
+    first_y, count_y = lens_footprint(pixel_y, pixel_L, P_L, P_I, g, num_of_lenses)
+    first_x_gpu = cuda.mem_alloc(first_x.nbytes)
+    count_x_gpu = cuda.mem_alloc(count_x.nbytes)
+    first_y_gpu = cuda.mem_alloc(first_y.nbytes)
+    count_y_gpu = cuda.mem_alloc(count_y.nbytes)
+    cuda.memcpy_htod(first_x_gpu, first_x)
+    cuda.memcpy_htod(count_x_gpu, count_x)
+    cuda.memcpy_htod(first_y_gpu, first_y)
+    cuda.memcpy_htod(count_y_gpu, count_y)
 
     mod = SourceModule("""
         __global__ void generate_EIA(float * R, float * G, float * B,
                                         float * elem_R, float * elem_G, float * elem_B,
                                         float * pixel_x, float * pixel_y, float * pixel_L,
-                                        float * elem_coords_x, float * elem_coords_y,
-                                        float * lens_loc_x, float * lens_loc_y,
+                                        float * lens_loc, float * lens_min,
+                                        int * first_x, int * count_x,
+                                        int * first_y, int * count_y,
                                         float P_L, float P_I, float g,
                                         int height, int width, int num_of_lenses) {
 
@@ -167,7 +237,6 @@ def generate_elemental_imgs_GPU(color, L, P_L, P_I, g, num_of_lenses):
             int i, j;
             float u, v;
             float p_i, p_j;
-            int shift_x, shift_y;
 
             int half_h = (int)(height / 2);
             int half_w = (int)(width / 2);
@@ -181,16 +250,18 @@ def generate_elemental_imgs_GPU(color, L, P_L, P_I, g, num_of_lenses):
             float lens_min_x, lens_min_y;
             
             if (p_x < width && p_y < height) {
-                for (i = 0; i < num_of_lenses; i++) {
-                    for (j = 0; j < num_of_lenses; j++) {
-                        shift_x = i * (int)P_L;
-                        shift_y = j * (int)P_L;
-                        
-                        u = P_L * lens_loc_x[i + j * num_of_lenses] - ((pixel_x[p_x + p_y * width] * P_I) - (P_L * lens_loc_x[i + j * num_of_lenses])) * (g / pixel_L[p_x + p_y * width]);
-                        v = P_L * lens_loc_y[i + j * num_of_lenses] - ((pixel_y[p_x + p_y * width] * P_I) - (P_L * lens_loc_y[i + j * num_of_lenses])) * (g / pixel_L[p_x + p_y * width]);
+                int i_first = first_x[p_x + p_y * width];
+                int i_last = i_first + count_x[p_x + p_y * width];
+                int j_first = first_y[p_x + p_y * width];
+                int j_last = j_first + count_y[p_x + p_y * width];
 
-                        lens_min_x = elem_coords_x[shift_x + shift_y * w_of_elem];
-                        lens_min_y = elem_coords_y[shift_x + shift_y * w_of_elem];
+                for (i = i_first; i < i_last; i++) {
+                    for (j = j_first; j < j_last; j++) {
+                        u = P_L * lens_loc[i] - ((pixel_x[p_x + p_y * width] * P_I) - (P_L * lens_loc[i])) * (g / pixel_L[p_x + p_y * width]);
+                        v = P_L * lens_loc[j] - ((pixel_y[p_x + p_y * width] * P_I) - (P_L * lens_loc[j])) * (g / pixel_L[p_x + p_y * width]);
+
+                        lens_min_x = lens_min[i];
+                        lens_min_y = lens_min[j];
 
                         if ((lens_min_x <= u && u <= lens_min_x + P_L) && (lens_min_y <= v && v <= lens_min_y + P_L)) {
                             u += half_w_elem;
@@ -211,42 +282,285 @@ def generate_elemental_imgs_GPU(color, L, P_L, P_I, g, num_of_lenses):
         }
     """)
     
-    gird_h = height // 20
-    gird_w = width // 20
+    # Round up so that tiles whose size is not a multiple of 20 are fully covered,
+    # the kernel skips the threads past the tile edge.
+    gird_h = (height + 19) // 20
+    gird_w = (width + 19) // 20
     func = mod.get_function("generate_EIA")
     func(R_gpu, G_gpu, B_gpu,
             elem_plane_R_gpu, elem_plane_G_gpu, elem_plane_B_gpu,
             pixel_x_gpu, pixel_y_gpu, pixel_L_gpu,
-            elem_coords_x_gpu, elem_coords_y_gpu,
-            lens_loc_x_gpu, lens_loc_y_gpu,
+            lens_loc_gpu, lens_min_gpu,
+            first_x_gpu, count_x_gpu,
+            first_y_gpu, count_y_gpu,
             np.float32(P_L), np.float32(P_I), np.float32(g),
             np.int32(height), np.int32(width), np.int32(num_of_lenses),
             block=(20, 20, 1),
             grid=(gird_w, gird_h))
 
-    elem_R = np.empty_like(elem_plane_R)
-    elem_G = np.empty_like(elem_plane_G)
-    elem_B = np.empty_like(elem_plane_B)
-    cuda.memcpy_dtoh(elem_R, elem_plane_R_gpu)
-    cuda.memcpy_dtoh(elem_G, elem_plane_G_gpu)
-    cuda.memcpy_dtoh(elem_B, elem_plane_B_gpu)
-    
-    EIA = np.stack([elem_R, elem_G, elem_B], axis=2)
-    inpainted_EIA = inpainting(EIA.astype(np.uint8), num_of_lenses, P_L)
+    # One float32 host buffer, converted channel by channel into the uint8 EIA.
+    elem_channel = np.empty((elem_plane_h, elem_plane_w), dtype=np.float32)
+    EIA = np.empty((elem_plane_h, elem_plane_w, 3), dtype=np.uint8)
+    for c, elem_plane_gpu in enumerate([elem_plane_R_gpu, elem_plane_G_gpu, elem_plane_B_gpu]):
+        cuda.memcpy_dtoh(elem_channel, elem_plane_gpu)
+        EIA[:, :, c] = elem_channel
+    return EIA
+
+
+def scatter_indices(pixel_x, pixel_y, pixel_L, P_L, P_I, g, num_of_lenses):
+    """Compute the EIA cells written by a set of object pixels.
+
+    Same arithmetic as the 'generate_EIA' CUDA kernel (float32), vectorized
+    over the object pixels. Only the lenses of 'lens_footprint' are visited.
+
+    Args:
+        pixel_x       : Flat x coordinates of object pixels. (float32)
+        pixel_y       : Flat y coordinates of object pixels. (float32)
+        pixel_L       : Flat converted depth of object pixels. (float32)
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+        g             : Gap between lens and display.
+        num_of_lenses : Number of lenses of lens array.
+    Returns:
+        dst           : Flat EIA indices (row * width + col) of the writes.
+        src           : Positions in the input arrays of the written pixels.
+    """
+    elem_plane_w = num_of_lenses * int(P_L)
+    half_elem = elem_plane_w // 2
+    index_dtype = np.int32 if elem_plane_w * elem_plane_w < 2 ** 31 else np.int64
+
+    first_x, count_x = lens_footprint(pixel_x, pixel_L, P_L, P_I, g, num_of_lenses)
+    first_y, count_y = lens_footprint(pixel_y, pixel_L, P_L, P_I, g, num_of_lenses)
+
+    P_L = np.float32(P_L)
+    ratio = np.float32(g) / pixel_L
+    obj_x = pixel_x * np.float32(P_I)
+    obj_y = pixel_y * np.float32(P_I)
+
+    # Lens locations and window origins as seen by the kernel.
+    lens_loc, lens_min = lens_geometry(num_of_lenses, P_L)
+
+    max_count_y = int(count_y.max()) if count_y.size else 0
+    offsets_y = np.arange(max_count_y)
+
+    dst_list, src_list = [], []
+    for offset_x in range(int(count_x.max()) if count_x.size else 0):
+        i = np.minimum(first_x + offset_x, num_of_lenses - 1)
+        u = P_L * lens_loc[i] - (obj_x - P_L * lens_loc[i]) * ratio
+        hit = np.nonzero((offset_x < count_x) & (lens_min[i] <= u) & (u <= lens_min[i] + P_L))[0]
+        if hit.size == 0:
+            continue
+
+        # Lens rows of the footprint for the pixels that hit lens column 'i'.
+        j = np.minimum(first_y[hit, None] + offsets_y[None, :], num_of_lenses - 1)
+        v = P_L * lens_loc[j] - (obj_y[hit, None] - P_L * lens_loc[j]) * ratio[hit, None]
+        valid = ((offsets_y[None, :] < count_y[hit, None]) &
+                 (lens_min[j] <= v) & (v <= lens_min[j] + P_L))
+        rows, _ = np.nonzero(valid)
+
+        col = (u[hit][rows] + half_elem).astype(np.int32)
+        row = (v[valid] + half_elem).astype(np.int32)
+        inside = (0 <= col) & (col < elem_plane_w) & (0 <= row) & (row < elem_plane_w)
+
+        dst_list.append(row[inside].astype(index_dtype) * elem_plane_w + col[inside])
+        src_list.append(hit[rows][inside].astype(np.int32))
+
+    if not dst_list:
+        return np.empty(0, dtype=index_dtype), np.empty(0, dtype=np.int32)
+    return np.concatenate(dst_list), np.concatenate(src_list)
+
+
+def scatter_bands(L, P_L, P_I, g, num_of_lenses, workers=None, plan=None, band_size=16384):
+    """Map the object pixels to EIA cells, band by band, on a thread pool.
+
+    The object pixels are split into row bands which are mapped in parallel
+    (NumPy releases the GIL). The bands are yielded in raster order as they
+    complete, so their writes can be applied and freed early. At most one
+    band per thread is submitted ahead of the one being yielded, which
+    bounds the band buffers alive at once.
+
+    Args:
+        L             : Converted depth information.
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+        g             : Gap between lens and display.
+        num_of_lenses : Number of lenses of lens array.
+        workers       : Number of threads. (default: number of CPUs)
+        plan          : PickupPlan of the tile shape. (built if None)
+        band_size     : Object pixels per task, bounds the memory of the writes in flight.
+    Yields:
+        dst           : Flat EIA indices of the writes of a band.
+        src           : Flat color index read by each write (see plan.source_index),
+                        the writes being in raster order of the object pixels.
+    """
+    height, width = L.shape[:2]
+    workers = workers or worker_threads()
+
+    plan = get_plan(plan, L, P_L, P_I, num_of_lenses)
+    pixel_x = plan.pixel_x
+    pixel_y = plan.pixel_y
+    pixel_L = np.ascontiguousarray(L, dtype=np.float32).ravel()
+
+    num_of_bands = max(-(-height * width // band_size), workers)
+    bands = np.array_split(np.arange(height * width, dtype=np.int32), num_of_bands)
+    bands = [band for band in bands if band.size]
+
+    def scatter_band(band):
+        dst, src = scatter_indices(pixel_x[band], pixel_y[band], pixel_L[band],
+                                   P_L, P_I, g, num_of_lenses)
+        # Restore raster order of the object pixels inside the band.
+        order = np.argsort(src, kind='stable')
+        return dst[order], plan.source[band[src[order]]]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for band in bands:
+            pending.append(executor.submit(scatter_band, band))
+            if len(pending) > workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def render_EIA_CPU(color, L, P_L, P_I, g, num_of_lenses, workers=None, plan=None, band_size=16384):
+    """Render elemental image array on the CPU with a thread pool.
+
+    The writes are applied in raster order of the object pixels (see
+    scatter_bands), so that the last object pixel wins wherever several of
+    them hit the same EIA cell. Both backends read the color of an object
+    pixel by the same rule (see plan.source_index). The CUDA kernel resolves
+    the collisions in arbitrary thread order, so both backends agree exactly
+    except on such contested cells (well under 1% of the written cells for
+    the default lens parameters).
+
+    Args:
+        color         : Color image.
+        L             : Converted depth information.
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+        g             : Gap between lens and display.
+        num_of_lenses : Number of lenses of lens array.
+        workers       : Number of threads. (default: number of CPUs)
+        plan          : PickupPlan of the tile shape. (built if None)
+        band_size     : Object pixels per task, bounds the memory of the writes in flight.
+    Returns:
+        EIA           : Elemental image array. (uint8, not inpainted)
+    """
+    elem_plane_h = elem_plane_w = P_L * num_of_lenses
+    EIA = np.zeros((elem_plane_h * elem_plane_w, 3), dtype=np.uint8)
+    colors = color.reshape(-1, 3)
+
+    for dst, src in scatter_bands(L, P_L, P_I, g, num_of_lenses, workers, plan, band_size):
+        EIA[dst] = colors[src]
+    return EIA.reshape(elem_plane_h, elem_plane_w, 3)
+
+
+RENDERERS = {
+    'gpu': render_EIA_GPU,
+    'cpu': render_EIA_CPU,
+    'gather': gather.render_EIA_gather,
+    'layered': layered.render_EIA_layered,
+}
+
+
+def generate_elemental_imgs(color, L, P_L, P_I, g, num_of_lenses, backend='gpu', inpaint=True,
+                            fill_method='ns', plan=None):
+    """Generate elemental images by paper's method.
+
+    Args:
+        color         : Color image.
+        L             : Converted depth information.
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+        g             : Gap between lens and display.
+        num_of_lenses : Number of lenses of lens array.
+        backend       : Renderer, one of 'gpu' (PyCUDA), 'cpu', 'gather' or 'layered'.
+        inpaint       : Fill pickup holes.
+        fill_method   : Hole filling method. (see holefill.METHODS)
+        plan          : PickupPlan of the tile shape, reused across tiles and frames.
+    Returns:
+        inpainted_EIA : Elemental image array.
+    """
+    if backend not in RENDERERS:
+        raise ValueError('Unknown pickup backend: {} (expected one of {})'.format(
+            backend, ', '.join(sorted(RENDERERS))))
+
+    EIA = RENDERERS[backend](color, L, P_L, P_I, g, num_of_lenses, plan=plan)
+    if not inpaint:
+        return EIA
+
+    inpainted_EIA = inpainting(EIA, num_of_lenses, P_L, fill_method)
     return inpainted_EIA
 
 
-def inpainting(EIA, num_of_lenses, P_L):
+def generate_elemental_imgs_GPU(color, L, P_L, P_I, g, num_of_lenses):
+    """Generate elemental images on the GPU. (see generate_elemental_imgs)"""
+    return generate_elemental_imgs(color, L, P_L, P_I, g, num_of_lenses, backend='gpu')
+
+
+def inpaint_EIA(EIA, num_of_lenses, P_L, method='ns', workers=None, batch_size=None):
+    """Fill the pickup holes of each elemental image.
+
+    The hole mask is built once for the whole array. Elemental images without
+    holes, or made only of holes (cv2.inpaint leaves those unchanged), are
+    skipped. The others are filled one lens at a time, so that no hole is
+    filled across a lens boundary, in batches spread over a thread pool.
+
+    Args:
+        EIA           : Elemental image array. (uint8)
+        num_of_lenses : Number of lenses of lens array.
+        P_L           : Size of elemental lens.
+        method        : Hole filling method. (see holefill.METHODS)
+        workers       : Number of threads. (default: number of CPUs)
+        batch_size    : Number of elemental images per task.
+                        (default: 256 for 'ns', 4096 for whole-batch methods)
+    Returns:
+        inpainted_EIA : Inpainted elemental image array.
+        stats         : Number of elemental images 'filled', 'skipped_clean' (no hole)
+                        and 'skipped_empty' (only holes).
+    """
+    mask = utils.hole_mask(EIA)
+    holes = mask.reshape(num_of_lenses, P_L, num_of_lenses, P_L).sum(axis=(1, 3))
+
+    todo = np.flatnonzero((holes > 0) & (holes < P_L * P_L))
+    stats = {
+        'filled': int(todo.size),
+        'skipped_clean': int(np.count_nonzero(holes == 0)),
+        'skipped_empty': int(np.count_nonzero(holes == P_L * P_L)),
+    }
+
     inpainted_EIA = EIA.copy()
-    for i in range(num_of_lenses):
-        for j in range(num_of_lenses):
-            elem = EIA[i * P_L:i * P_L + P_L, j * P_L:j * P_L + P_L]
-            gray = cv2.cvtColor(elem, cv2.COLOR_RGB2GRAY)
+    lenses = EIA.reshape(num_of_lenses, P_L, num_of_lenses, P_L, 3)
+    lens_masks = mask.reshape(num_of_lenses, P_L, num_of_lenses, P_L)
+    filled_lenses = inpainted_EIA.reshape(num_of_lenses, P_L, num_of_lenses, P_L, 3)
+
+    def inpaint_batch(batch):
+        i, j = np.divmod(batch, num_of_lenses)
+        images = lenses[i, :, j]
+        masks = lens_masks[i, :, j]
+        filled_lenses[i, :, j] = holefill.fill_holes(images, masks, method, radius=5)
 
-            _, thresh = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
-            mask = cv2.bitwise_not(thresh)
+    if batch_size is None:
+        batch_size = 256 if method == 'ns' else 4096
 
-            inpainted = cv2.inpaint(elem, mask, 5, cv2.INPAINT_NS)
+    if todo.size:
+        batches = np.array_split(todo, -(-todo.size // batch_size))
+        workers = workers or worker_threads()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(inpaint_batch, batches))
+    return inpainted_EIA, stats
 
-            inpainted_EIA[i * P_L:i * P_L + P_L, j * P_L:j * P_L + P_L] = inpainted
-    return inpainted_EIA
\ No newline at end of file
+
+def inpainting(EIA, num_of_lenses, P_L, method='ns'):
+    """Fill the pickup holes of each elemental image. (see inpaint_EIA)
+
+    Args:
+        EIA           : Elemental image array. (uint8)
+        num_of_lenses : Number of lenses of lens array.
+        P_L           : Size of elemental lens.
+        method        : Hole filling method. (see holefill.METHODS)
+    Returns:
+        inpainted_EIA : Inpainted elemental image array.
+    """
+    inpainted_EIA, _ = inpaint_EIA(EIA, num_of_lenses, P_L, method)
+    return inpainted_EIA
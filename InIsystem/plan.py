@@ -0,0 +1,112 @@
+""" Precomputed lens-array geometry shared by every tile and frame """
+
+import functools
+import numpy as np
+
+import utils
+import InIsystem.convert as cvt
+
+
+@functools.lru_cache(maxsize=None)
+def lens_geometry(num_of_lenses, P_L):
+    """Lens locations and elemental image window origins (per axis).
+
+    Args:
+        num_of_lenses : Number of lenses of lens array.
+        P_L           : Size of elemental lens.
+    Returns:
+        lens_loc      : Location of each lens, (num_of_lenses,). (float32, read-only)
+        lens_min      : Origin of the elemental image window of each lens, (num_of_lenses,). (float32, read-only)
+    """
+    elem_plane_w = num_of_lenses * int(P_L)
+    lens_loc = utils.generate_coords(1, num_of_lenses)[0, 0]
+    lens_min = np.ascontiguousarray(utils.generate_coords(1, elem_plane_w)[0, 0, ::int(P_L)])
+
+    lens_loc.setflags(write=False)
+    lens_min.setflags(write=False)
+    return lens_loc, lens_min
+
+
+def source_index(pixel_x, pixel_y, height, width):
+    """Object pixel whose color each pixel position reads, by the rule of the CUDA kernel.
+
+    The kernel reads the color at (int)(x + width / 2) + (int)(y + height / 2) * width.
+    This is the raster index when the size is even. For an odd size, the coordinates of
+    utils.generate_coords step by less than one pixel, so a pixel reads its left / upper
+    neighbour for most of the tile. Every renderer follows the same rule.
+
+    Args:
+        pixel_x : x coordinate of each pixel. (float32)
+        pixel_y : y coordinate of each pixel. (float32)
+        height  : Object image height.
+        width   : Object image width.
+    Returns:
+        source  : Flat color index of each pixel. (int32)
+    """
+    p_i = (pixel_x + np.float32(width // 2)).astype(np.int32)
+    p_j = (pixel_y + np.float32(height // 2)).astype(np.int32)
+    return p_i + p_j * np.int32(width)
+
+
+class PickupPlan():
+    """Geometry of the pickup of one tile shape, built once and reused.
+
+    Holds the object pixel coordinates and the lens geometry in float32, and
+    the color index read by each object pixel (see source_index). It only
+    depends on the lens parameters and the tile shape and is read-only. A
+    pickled plan only holds its parameters. (see cached_plan)
+
+    Args:
+        height        : Tile height.
+        width         : Tile width.
+        num_of_lenses : Number of lenses of lens array.
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+    """
+    def __init__(self, height, width, num_of_lenses, P_L, P_I):
+        self.height = height
+        self.width = width
+        self.num_of_lenses = num_of_lenses
+        self.P_L = P_L
+        self.P_I = P_I
+        self.elem_plane_w = num_of_lenses * P_L
+
+        self.lens_loc, self.lens_min = lens_geometry(num_of_lenses, P_L)
+
+        coords = utils.generate_coords(height, width)
+        self.pixel_x = coords[0].ravel()
+        self.pixel_y = coords[1].ravel()
+        self.source = source_index(self.pixel_x, self.pixel_y, height, width)
+        self.pixel_x.setflags(write=False)
+        self.pixel_y.setflags(write=False)
+        self.source.setflags(write=False)
+
+    @classmethod
+    def from_lens_params(cls, inputs, tile_shape):
+        """Build a plan from main.get_lens_params() and a tile shape (height, width[, 3])."""
+        d = cvt.central_depth(inputs['f'], inputs['g'])
+        P_I = cvt.pixel_size_object_img(d, inputs['g'], inputs['P_D'])
+        return cls(tile_shape[0], tile_shape[1], inputs['num_of_lenses'], inputs['P_L'], P_I)
+
+    def matches(self, height, width, num_of_lenses, P_L, P_I):
+        return (self.height, self.width, self.num_of_lenses, self.P_L, self.P_I) == \
+            (height, width, num_of_lenses, P_L, P_I)
+
+    def __reduce__(self):
+        # Only the parameters go through the pool pipes, each worker builds the plan
+        # once and reuses it for every later tile and frame.
+        return cached_plan, (self.height, self.width, self.num_of_lenses, self.P_L, self.P_I)
+
+
+@functools.lru_cache(maxsize=16)
+def cached_plan(height, width, num_of_lenses, P_L, P_I):
+    """PickupPlan of these parameters, built once per process."""
+    return PickupPlan(height, width, num_of_lenses, P_L, P_I)
+
+
+def get_plan(plan, color, P_L, P_I, num_of_lenses):
+    """Return 'plan' if it fits the color image and lens parameters, else build one."""
+    height, width = color.shape[:2]
+    if plan is not None and plan.matches(height, width, num_of_lenses, P_L, P_I):
+        return plan
+    return PickupPlan(height, width, num_of_lenses, P_L, P_I)
@@ -0,0 +1,126 @@
+""" Per-stage tracing of the pipeline (wall time, CPU time, memory) with Chrome trace export """
+
+import os
+import json
+import time
+import threading
+
+from InIsystem.memory import MB, peak_rss, current_rss
+
+
+class _NullStage():
+    """Context manager of a disabled profiler: does nothing."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage():
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.cpu = time.process_time()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        cpu = time.process_time() - self.cpu
+        self.profiler.events.append({
+            'name': self.name,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'start_us': self.start / 1e3,
+            'wall': (end - self.start) / 1e9,
+            'cpu': cpu,
+            'peak_rss': peak_rss(),
+            'rss': current_rss(),
+            'args': self.args,
+        })
+        return False
+
+
+class Profiler():
+    """Record the wall time, CPU time and memory of named pipeline stages.
+
+        profiler = Profiler()
+        with profiler.stage('render_EIA', tile=3):
+            ...
+
+    CPU time is the time of the whole process, so it includes the thread
+    pools of a stage. 'peak_rss' is the process high-water mark at the end
+    of the stage (it never decreases), 'rss' the resident memory at that time.
+    Timestamps come from the monotonic clock, which is shared by the worker
+    processes, so their events line up in one trace.
+
+    A disabled profiler returns one shared no-op context manager, so the
+    stages cost one attribute test.
+
+    Args:
+        enabled : Record the stages.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.events = []
+
+    def stage(self, name, **args):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, args)
+
+    def extend(self, events):
+        """Add the events recorded by another process."""
+        self.events.extend(events or [])
+
+    def __getstate__(self):
+        # A copy sent to a pool worker starts empty, the worker sends its own events back.
+        return {'enabled': self.enabled, 'events': []}
+
+    def summary(self):
+        """Aggregate the events by stage.
+
+        Returns:
+            summary : {stage: {'count', 'wall', 'cpu', 'peak_rss'}} with summed times and the largest peak.
+        """
+        summary = {}
+        for event in self.events:
+            stage = summary.setdefault(event['name'], {'count': 0, 'wall': 0., 'cpu': 0., 'peak_rss': 0})
+            stage['count'] += 1
+            stage['wall'] += event['wall']
+            stage['cpu'] += event['cpu']
+            stage['peak_rss'] = max(stage['peak_rss'], event['peak_rss'])
+        return summary
+
+    def report(self):
+        return '\n'.join('{:<16s} x{:<3d} wall {:8.3f} s  cpu {:8.3f} s  peak RSS {:6.0f} MB'.format(
+            name, s['count'], s['wall'], s['cpu'], s['peak_rss'] / MB) for name, s in self.summary().items())
+
+    def save_json(self, path):
+        """Write the events and their per-stage summary."""
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(), 'events': self.events}, f, indent=2)
+
+    def save_chrome_trace(self, path):
+        """Write the events in Chrome trace-event format. (chrome://tracing, Perfetto)"""
+        trace = []
+        for pid in sorted({event['pid'] for event in self.events}):
+            name = 'main' if pid == os.getpid() else 'worker {}'.format(pid)
+            trace.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': name}})
+
+        for event in self.events:
+            args = dict(event['args'], cpu_ms=event['cpu'] * 1e3,
+                        peak_rss_mb=event['peak_rss'] / MB, rss_mb=event['rss'] / MB)
+            trace.append({'name': event['name'], 'cat': 'pipeline', 'ph': 'X',
+                          'ts': event['start_us'], 'dur': event['wall'] * 1e6,
+                          'pid': event['pid'], 'tid': event['tid'], 'args': args})
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
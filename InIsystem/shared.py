@@ -0,0 +1,80 @@
+""" Numpy arrays in shared memory for the pickup worker pool """
+
+import numpy as np
+
+from multiprocessing import shared_memory
+
+
+class SharedArray:
+    """Numpy array backed by a named shared memory block.
+
+    Pickling only sends the name, shape and dtype of the block, so passing
+    a SharedArray to a pool worker costs nothing whatever the array size.
+    The worker attaches the same memory: what it writes is seen by the parent.
+
+    The process that created the block owns it and must 'unlink' it once
+    every worker is done. (see 'SharedArray.create' used as a context manager)
+    """
+
+    def __init__(self, name, shape, dtype, create=False):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.owner = create
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    @classmethod
+    def create(cls, shape, dtype):
+        """Allocate a new zero-filled shared array.
+
+        Args:
+            shape  : Array shape.
+            dtype  : Array dtype.
+        Returns:
+            shared : SharedArray owning the block.
+        """
+        shared = cls(None, shape, dtype, create=True)
+        shared.array[...] = 0
+        return shared
+
+    @classmethod
+    def from_array(cls, array):
+        """Copy an array into a new shared array.
+
+        Args:
+            array  : Numpy array.
+        Returns:
+            shared : SharedArray owning the block.
+        """
+        array = np.asarray(array)
+        shared = cls(None, array.shape, array.dtype, create=True)
+        shared.array[...] = array
+        return shared
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def __getstate__(self):
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype.str}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], state['shape'], state['dtype'])
+
+    def close(self):
+        """Detach from the block. The array must not be used afterwards."""
+        self.array = None
+        self.shm.close()
+
+    def unlink(self):
+        """Close and free the block. (owner only)"""
+        self.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.unlink()
@@ -1,21 +1,24 @@
-import os
 import cv2
 import numpy as np
 
 from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
 
 """ Convert elemental image array to sub aperture image array """
 
 import utils
+import InIsystem.gather as gather
+import InIsystem.holefill as holefill
+from InIsystem.memory import worker_threads
 
 
 def inpainting(sub_aperture):
-    """
+    """Fill the pickup holes of a sub-aperture image.
 
     Args:
-    
+        sub_aperture : Sub-aperture image. (uint8)
     Returns:
-    
+        inpainted    : Inpainted sub-aperture image.
     """
     color = sub_aperture
     gray = cv2.cvtColor(color, cv2.COLOR_RGB2GRAY)
@@ -27,28 +30,180 @@ def inpainting(sub_aperture):
     return inpainted
 
 
-def generate_sub_apertures(elem_plane, P_L, num_of_lenses):
+def extract_sub_apertures(elem_plane, P_L, num_of_lenses, copy=False):
+    """Rearrange elemental image array into sub-aperture images.
+
+    Sub-aperture image (p, q) gathers pixel (p, q) under every lens, which is
+    a reshape / transpose of the elemental image array.
+
+    Args:
+        elem_plane    : Elemental image array, (num_of_lenses * P_L, num_of_lenses * P_L, 3).
+        P_L           : Size of elemental lens.
+        num_of_lenses : Number of lenses of lens array.
+        copy          : If False, return a strided view (no pixel is copied for uint8 input).
+                        If True, return one contiguous copy.
+    Returns:
+        sub_apertures :
+            copy is False : (P_L, num_of_lenses, P_L, num_of_lenses, 3) view,
+                            sub-aperture (p, q) is sub_apertures[p, :, q].
+            copy is True  : (P_L * num_of_lenses, P_L * num_of_lenses, 3) array,
+                            sub-aperture (p, q) is the (p, q) block of num_of_lenses pixels.
+    """
+    elem_plane = np.asarray(elem_plane)
+    if elem_plane.dtype != np.uint8:
+        elem_plane = elem_plane.astype(np.uint8)
+
+    lenses = elem_plane.reshape(num_of_lenses, P_L, num_of_lenses, P_L, 3)
+    sub_apertures = lenses.transpose(1, 0, 3, 2, 4)
+    if copy:
+        sub_apertures = sub_apertures.reshape(P_L * num_of_lenses, P_L * num_of_lenses, 3)
+    return sub_apertures
+
+
+def parse_views(P_L, views=None):
+    """Normalize a selection of sub-aperture views.
+
+    Args:
+        P_L   : Size of elemental lens. (number of views along each axis)
+        views : Selected views, one of
+                    None         : every view.
+                    (rows, cols) : tuple, grid of views. rows / cols are ranges, slices or index lists.
+                    [(p, q), ..] : list, explicit views.
+    Returns:
+        rows  : Row index of each selected view.
+        cols  : Column index of each selected view.
+        grid  : (number of rows, number of columns) for a grid selection, else None.
+    """
+    if views is None:
+        views = (range(P_L), range(P_L))
+
+    if isinstance(views, tuple):
+        grid_rows, grid_cols = [np.arange(P_L)[v] if isinstance(v, slice) else np.asarray(v, dtype=int)
+                                for v in views]
+        rows, cols = np.meshgrid(grid_rows, grid_cols, indexing='ij')
+        rows, cols = rows.ravel(), cols.ravel()
+        grid = (len(grid_rows), len(grid_cols))
+    else:
+        rows, cols = np.asarray(views, dtype=int).reshape(-1, 2).T
+        grid = None
+
+    if rows.size and (min(rows.min(), cols.min()) < 0 or max(rows.max(), cols.max()) >= P_L):
+        raise ValueError('Sub-aperture views must lie in [0, {})'.format(P_L))
+    return rows, cols, grid
+
+
+def inpaint_views(views, workers=None, method='ns', chunk_pixels=1 << 20):
+    """Inpaint a stack of sub-aperture images.
+
+    'ns' inpaints every view on a thread pool, other methods fill the views
+    with holes a whole chunk at a time.
+
+    Args:
+        views        : Sub-aperture image stack, (number of views, num_of_lenses, num_of_lenses, 3).
+        workers      : Number of threads. (default: number of CPUs)
+        method       : Hole filling method. (see holefill.METHODS)
+        chunk_pixels : Pixels filled at once by whole-stack methods, bounds their float temporaries.
+    Returns:
+        filled       : Inpainted sub-aperture image stack. (uint8)
+    """
+    if method != 'ns':
+        masks = utils.hole_mask(views)
+        todo = np.flatnonzero(masks.any(axis=(1, 2)))
+
+        filled = np.array(views, dtype=np.uint8)
+        chunk = max(chunk_pixels // (views.shape[1] * views.shape[2]), 1)
+        for start in range(0, todo.size, chunk):
+            k = todo[start:start + chunk]
+            filled[k] = holefill.fill_holes(filled[k], masks[k], method)
+        return filled
+
+    filled = np.empty(views.shape, dtype=np.uint8)
+
+    def inpaint_view(k):
+        # cv2 needs a contiguous image, and releases the GIL while inpainting.
+        filled[k] = inpainting(np.ascontiguousarray(views[k]))
+
+    workers = workers or worker_threads()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(inpaint_view, range(len(views))))
+    return filled
+
+
+def inpaint_sub_apertures(sub_apertures, workers=None, method='ns'):
+    """Inpaint a grid of sub-aperture images.
+
+    Args:
+        sub_apertures : Strided sub-aperture view. (see extract_sub_apertures)
+        workers       : Number of threads. (default: number of CPUs)
+        method        : Hole filling method. (see holefill.METHODS)
+    Returns:
+        inpainted     : Inpainted sub-aperture image array,
+                        (rows * num_of_lenses, columns * num_of_lenses, 3).
     """
+    n_rows, num_of_lenses, n_cols = sub_apertures.shape[:3]
+    views = sub_apertures.transpose(0, 2, 1, 3, 4).reshape(n_rows * n_cols, num_of_lenses, num_of_lenses, 3)
+
+    filled = inpaint_views(views, workers, method)
+    filled = filled.reshape(n_rows, n_cols, num_of_lenses, num_of_lenses, 3).transpose(0, 2, 1, 3, 4)
+    return filled.reshape(n_rows * num_of_lenses, n_cols * num_of_lenses, 3)
+
+
+def generate_sub_apertures(elem_plane, P_L, num_of_lenses, workers=None, fill_method='ns', views=None):
+    """Generate inpainted sub-aperture image array from elemental image array.
+
+    Only the selected views are extracted and inpainted.
 
     Args:
-    
+        elem_plane    : Elemental image array.
+        P_L           : Size of elemental lens.
+        num_of_lenses : Number of lenses of lens array.
+        workers       : Number of inpainting threads. (default: number of CPUs)
+        fill_method   : Hole filling method. (see holefill.METHODS)
+        views         : Selected views. (see parse_views, default: every view)
     Returns:
-    
+        sub_apertures : (uint8)
+            grid selection : Sub-aperture image array, (rows * num_of_lenses, columns * num_of_lenses, 3).
+            list selection : Sub-aperture image stack, (number of views, num_of_lenses, num_of_lenses, 3).
     """
-    sub_apertures = np.zeros((P_L * num_of_lenses, P_L * num_of_lenses, 3))
-    sub_aperture = np.zeros((num_of_lenses, num_of_lenses, 3))
+    rows, cols, grid = parse_views(P_L, views)
+    sub_apertures = extract_sub_apertures(elem_plane, P_L, num_of_lenses)
+
+    selected = inpaint_views(sub_apertures[rows, :, cols], workers, fill_method)
+    return assemble_views(selected, grid)
+
 
-    for elem_i in range(P_L):
-        for elem_j in range(P_L):
-            y_start = elem_i * num_of_lenses
-            y_end = elem_i * num_of_lenses + num_of_lenses
-            x_start = elem_j * num_of_lenses
-            x_end = elem_j * num_of_lenses + num_of_lenses
+def assemble_views(selected, grid):
+    """Lay out a stack of views: a mosaic for a grid selection, else the stack itself."""
+    if grid is None:
+        return selected
 
-            for i in range(num_of_lenses):
-                for j in range(num_of_lenses):
-                    sub_aperture[i, j, :] = elem_plane[elem_i + (i * P_L), elem_j + (j * P_L), :]
+    num_of_lenses = selected.shape[1]
+    selected = selected.reshape(grid[0], grid[1], num_of_lenses, num_of_lenses, 3).transpose(0, 2, 1, 3, 4)
+    return selected.reshape(grid[0] * num_of_lenses, grid[1] * num_of_lenses, 3)
 
-            sub_apertures[y_start:y_end, x_start:x_end] = inpainting(sub_aperture.astype(np.uint8))
 
-    return sub_apertures
\ No newline at end of file
+def generate_sub_apertures_direct(color, L, P_L, P_I, g, num_of_lenses, workers=None, fill_method='ns',
+                                  views=None, steps=None):
+    """Generate inpainted sub-aperture images straight from the color image and depth.
+
+    Same views and layout as 'generate_sub_apertures' on the EIA of the
+    'gather' renderer, but the EIA is never built, so its empty cells are
+    filled in the views instead of in each elemental image.
+
+    Args:
+        color         : Color image.
+        L             : Converted depth information.
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+        g             : Gap between lens and display.
+        num_of_lenses : Number of lenses of lens array.
+        workers       : Number of threads. (default: number of CPUs)
+        fill_method   : Hole filling method. (see holefill.METHODS)
+        views         : Selected views. (see parse_views, default: every view)
+        steps         : Number of depth samples of each ray. (see gather.ray_samples)
+    Returns:
+        sub_apertures : (uint8, see generate_sub_apertures)
+    """
+    rows, cols, grid = parse_views(P_L, views)
+    selected = gather.synthesize_views(color, L, P_L, P_I, g, num_of_lenses, rows, cols, steps, workers)
+    return assemble_views(inpaint_views(selected, workers, fill_method), grid)
@@ -0,0 +1,194 @@
+""" Tile grid of the hierarchical pickup and merge layout of the tile views """
+
+import numpy as np
+
+import InIsystem.convert as cvt
+from InIsystem.subaperture import parse_views
+
+
+def tile_size(num_of_lenses, P_L, P_I):
+    """Size of the object image region covered by the lens array.
+
+    Args:
+        num_of_lenses : Number of lenses of lens array.
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+    Returns:
+        tile          : Tile size in object image pixels.
+    """
+    return int(round(num_of_lenses * P_L / P_I))
+
+
+def tile_origins(size, tile, max_stride):
+    """Evenly spaced tile origins covering one image axis.
+
+    Args:
+        size       : Image height (or width).
+        tile       : Tile size.
+        max_stride : Largest distance between two consecutive origins.
+    Returns:
+        origins    : Tile origins, from 0 to size - tile.
+    """
+    if size < tile:
+        raise ValueError('Image axis of {} pixels is smaller than a tile of {} pixels'.format(size, tile))
+
+    num_of_tiles = int(np.ceil((size - tile) / max_stride)) + 1
+    if num_of_tiles == 1:
+        return [0]
+    return [int(round(k * (size - tile) / (num_of_tiles - 1))) for k in range(num_of_tiles)]
+
+
+def merge_offsets(origins, num_of_lenses, scale):
+    """Part of the tile views kept along one axis of the merged view.
+
+    The first tile is kept whole, every next tile only adds the view pixels
+    of its own stride, taken from its far edge.
+
+    Args:
+        origins       : Tile origins along the axis.
+        num_of_lenses : Number of lenses of lens array. (view size)
+        scale         : View pixels per object image pixel.
+    Returns:
+        src           : First kept view pixel of each tile.
+        dst           : Position of that pixel in the merged view.
+        size          : Merged view size along the axis.
+    """
+    position = [int(round(origin * scale)) for origin in origins]
+    src = [0] + [num_of_lenses - (position[k] - position[k - 1]) for k in range(1, len(origins))]
+    dst = [0] + [num_of_lenses + position[k - 1] for k in range(1, len(origins))]
+    return src, dst, num_of_lenses + position[-1]
+
+
+class TilingPlan():
+    """Tile grid of an input image and merge layout of the tile views.
+
+    A sub-aperture view has one pixel per lens, so a view of 'num_of_lenses'
+    pixels covers a tile of 'num_of_lenses * P_L / P_I' object pixels. The
+    tiles are spaced by at most 'max_stride', and the merged views stitch
+    the part of every tile view that the previous tile does not cover.
+
+    Args:
+        height        : Input image height.
+        width         : Input image width.
+        num_of_lenses : Number of lenses of lens array.
+        P_L           : Size of elemental lens.
+        P_I           : Pixel size of the object image.
+        views         : Grid of merged sub-aperture views. (see subaperture.parse_views)
+        max_stride    : Largest tile stride. (default: a third of a tile)
+    """
+    def __init__(self, height, width, num_of_lenses, P_L, P_I, views=None, max_stride=None):
+        self.height = height
+        self.width = width
+        self.num_of_lenses = num_of_lenses
+        self.tile = tile_size(num_of_lenses, P_L, P_I)
+        self.max_stride = max_stride or self.tile // 3
+        if not 0 < self.max_stride <= self.tile:
+            raise ValueError('Tile stride must lie in (0, {}]'.format(self.tile))
+
+        rows, cols, self.grid = parse_views(P_L, views)
+        if self.grid is None:
+            raise ValueError('Merged sub-aperture views must be a grid (rows, cols)')
+        self.view_rows = rows.reshape(self.grid)[:, 0]
+        self.view_cols = cols.reshape(self.grid)[0]
+
+        self.row_origins = tile_origins(height, self.tile, self.max_stride)
+        self.col_origins = tile_origins(width, self.tile, self.max_stride)
+
+        scale = num_of_lenses / self.tile
+        self.row_src, self.row_dst, view_h = merge_offsets(self.row_origins, num_of_lenses, scale)
+        self.col_src, self.col_dst, view_w = merge_offsets(self.col_origins, num_of_lenses, scale)
+        self.view_shape = (view_h, view_w)
+        self.merged_shape = (view_h * self.grid[0], view_w * self.grid[1], 3)
+
+    @classmethod
+    def from_lens_params(cls, inputs, image_shape, views=None, max_stride=None):
+        """Build a plan from main.get_lens_params() and an image shape (height, width[, 3])."""
+        d = cvt.central_depth(inputs['f'], inputs['g'])
+        P_I = cvt.pixel_size_object_img(d, inputs['g'], inputs['P_D'])
+        return cls(image_shape[0], image_shape[1], inputs['num_of_lenses'], inputs['P_L'], P_I,
+                   views, max_stride)
+
+    @property
+    def tile_shape(self):
+        return (self.tile, self.tile, 3)
+
+    @property
+    def origins(self):
+        """Top-left corners (h, w) of the tiles, row by row."""
+        return [(h, w) for h in self.row_origins for w in self.col_origins]
+
+    def __len__(self):
+        return len(self.row_origins) * len(self.col_origins)
+
+    def tile_slices(self, index):
+        """(rows, cols) slices of a tile in the input image."""
+        h, w = self.origins[index]
+        return slice(h, h + self.tile), slice(w, w + self.tile)
+
+    def layout(self, index):
+        """Part of the views of a tile kept in the merged views.
+
+        Args:
+            index : Tile index, row by row.
+        Returns:
+            src   : (row, column) where the kept part of a tile view starts.
+            dst   : (row, column) where it goes in a merged view.
+        """
+        tile_row, tile_col = divmod(index, len(self.col_origins))
+        return (self.row_src[tile_row], self.col_src[tile_col]), \
+            (self.row_dst[tile_row], self.col_dst[tile_col])
+
+    @property
+    def views(self):
+        """(p, q) of the merged views, row by row."""
+        return [(p, q) for p in self.view_rows for q in self.view_cols]
+
+    @property
+    def stack_shape(self):
+        """Shape of the merged views as a stack, one view after the other."""
+        return (self.grid[0] * self.grid[1],) + self.view_shape + (3,)
+
+    def view_grid(self, merged):
+        """(view rows, view height, view cols, view width, 3) view of merged views, no copy.
+
+        Args:
+            merged : Merged views, as a mosaic ('merged_shape') or a stack ('stack_shape').
+        Returns:
+            grid   : Array sharing the memory of 'merged'.
+        """
+        view_h, view_w = self.view_shape
+        if merged.ndim == 3:
+            return merged.reshape(self.grid[0], view_h, self.grid[1], view_w, 3)
+        return merged.reshape(self.grid[0], self.grid[1], view_h, view_w, 3).transpose(0, 2, 1, 3, 4)
+
+    def write(self, sub_apertures, index, merged):
+        """Copy the kept part of the views of one tile into the merged views.
+
+        Tiles write disjoint regions, so several workers can write into one
+        shared output without locking.
+
+        Args:
+            sub_apertures : Sub-aperture image mosaic of the tile. (see subaperture.generate_sub_apertures)
+            index         : Tile index, row by row.
+            merged        : Merged views as a mosaic or a stack, written in place.
+        """
+        N = self.num_of_lenses
+        (src_row, src_col), (dst_row, dst_col) = self.layout(index)
+        height, width = N - src_row, N - src_col
+
+        grid = self.view_grid(merged)
+        tile = sub_apertures.reshape(self.grid[0], N, self.grid[1], N, 3)
+        grid[:, dst_row:dst_row + height, :, dst_col:dst_col + width] = tile[:, src_row:, :, src_col:]
+
+    def merge(self, outputs):
+        """Merge the sub-aperture image mosaics of every tile.
+
+        Args:
+            outputs : Sub-aperture image mosaic of each tile, row by row.
+        Returns:
+            merged  : Merged sub-aperture image mosaic. (uint8)
+        """
+        merged = np.zeros(self.merged_shape, dtype=np.uint8)
+        for index, sub_apertures in enumerate(outputs):
+            self.write(sub_apertures, index, merged)
+        return merged
@@ -0,0 +1,140 @@
+""" Pickup worker of the tile pool
+
+Only imports what a pickup worker needs (NumPy, OpenCV and InIsystem).
+The depth model, TensorFlow and the output writers stay in the parent.
+"""
+
+import os
+import multiprocessing
+
+import InIsystem.convert as cvt
+import InIsystem.pickup as pickup
+import InIsystem.subaperture as sub
+from InIsystem.profiler import Profiler
+from InIsystem.memory import StageMemory
+
+
+# Sub-aperture views (rows, columns) merged into the large FOV image.
+MERGED_VIEWS = (range(7, 14), range(7, 14))
+
+
+def worker_pool(processes=4):
+    """Pool of pickup workers.
+
+    Where available, the workers are forked from a server process that
+    imported this module once, so they start without re-importing NumPy,
+    OpenCV and InIsystem. The server never touches CUDA, so the workers can
+    still use PyCUDA. Elsewhere the workers are spawned.
+
+    Args:
+        processes : Number of workers.
+    Returns:
+        pool      : multiprocessing.Pool.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+    else:
+        context = multiprocessing.get_context('spawn')
+    return context.Pool(processes=processes)
+
+
+def multiprocess_ini(inputs, data, backend='gpu', fill_method='ns', plan=None, memory_report=False,
+                     profiler=None, tile=None, views=MERGED_VIEWS):
+    """Multi-process integral imaging pickup system for each part of images.
+
+    Args:
+        inputs        : Parameter for integarl imaging pickup system.
+        data          : RGB image and depth image data.
+        backend       : Elemental image renderer. ('gpu', 'cpu', 'gather', 'layered')
+                        or 'direct' to render the views without the EIA.
+        fill_method   : Hole filling method. ('ns' or 'pullpush')
+        plan          : PickupPlan shared by every tile.
+        memory_report : Print the peak RSS of each stage.
+        profiler      : Profiler recording each stage. (default: disabled)
+        tile          : Tile index, recorded with the stages.
+        views         : Grid of sub-aperture views. (see subaperture.parse_views)
+    Returns:
+        sub_apertures : Sub-aperture image array.
+    """
+    image = data[0]
+    depth = data[1]
+    memory = StageMemory()
+    profiler = profiler or Profiler(enabled=False)
+    
+    with profiler.stage('convert_depth', tile=tile):
+        d, P_I, delta_d, L = cvt.convert_depth(depth, inputs['f'], inputs['g'],
+                                            inputs['P_D'], inputs['P_L'])
+    memory.record('convert_depth')
+
+    # Views straight from the color image and depth, the EIA is never built.
+    if backend == 'direct':
+        with profiler.stage('sub_apertures', tile=tile, backend=backend):
+            sub_apertures = sub.generate_sub_apertures_direct(image, L, inputs['P_L'], P_I, inputs['g'],
+                                                              inputs['num_of_lenses'],
+                                                              fill_method=fill_method, views=views)
+        memory.record('sub_apertures')
+
+        if memory_report:
+            print(memory.report('[pid {}] '.format(os.getpid())))
+        return sub_apertures
+
+    with profiler.stage('render_EIA', tile=tile, backend=backend):
+        EIA = pickup.generate_elemental_imgs(image, L, inputs['P_L'],
+                                             P_I, inputs['g'], inputs['num_of_lenses'],
+                                             backend=backend, inpaint=False, plan=plan)
+
+    with profiler.stage('inpaint_EIA', tile=tile, fill_method=fill_method):
+        EIA = pickup.inpainting(EIA, inputs['num_of_lenses'], inputs['P_L'], fill_method)
+    memory.record('pickup')
+
+    with profiler.stage('sub_apertures', tile=tile):
+        sub_apertures = sub.generate_sub_apertures(EIA, inputs['P_L'], inputs['num_of_lenses'],
+                                                   fill_method=fill_method, views=views)
+    memory.record('sub_apertures')
+
+    if memory_report:
+        print(memory.report('[pid {}] '.format(os.getpid())))
+    return sub_apertures
+
+
+def multiprocess_shared(inputs, tiling, shared, index, profiler=None, **kwargs):
+    """Pickup one tile read from shared memory and write its views in place.
+
+    Only the names of the shared blocks and the tile index go through
+    the pool pipes, neither the tiles nor the sub-aperture images.
+
+    Args:
+        inputs   : Parameter for integarl imaging pickup system.
+        tiling   : TilingPlan of the input image.
+        shared   : SharedArray of the RGB image, of the depth image and of the large FOV views.
+        index    : Tile index, row by row.
+        profiler : Profiler recording each stage. (default: disabled)
+        kwargs   : Options of 'multiprocess_ini'.
+    Returns:
+        events   : Stages recorded by this call.
+    """
+    image, depth, LFOV_sub_apertures = shared
+    tile = tiling.tile_slices(index)
+    # The tasks of one pool chunk share the unpickled profiler, each call records into its own.
+    profiler = Profiler(enabled=profiler is not None and profiler.enabled)
+
+    sub_apertures = multiprocess_ini(inputs, (image.array[tile], depth.array[tile]),
+                                     profiler=profiler, tile=index,
+                                     views=(tiling.view_rows, tiling.view_cols), **kwargs)
+    with profiler.stage('merge', tile=index):
+        tiling.write(sub_apertures, index, LFOV_sub_apertures.array)
+    return profiler.events
+
+
+def run_task(task):
+    """Run one task of a flat job list, for Pool.imap_unordered or Pool.apply_async.
+
+    Args:
+        task : (key, function, argument), the function being picklable. (e.g. a partial of 'multiprocess_shared')
+    Returns:
+        key  : Key of the task, to route the result.
+        out  : function(argument).
+    """
+    key, func, arg = task
+    return key, func(arg)
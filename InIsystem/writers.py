@@ -0,0 +1,176 @@
+""" Output writers of the merged sub-aperture views """
+
+import os
+import json
+import numpy as np
+
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+
+# 'mosaic'    : every view in one 'large_FOV_sub_apertures.jpg'.
+# 'png', 'jpg': one image file per view.
+# 'npy'       : memory-mapped view stack 'sub_apertures.npy', (views, height, width, 3).
+# 'chunked'   : directory of one '.npy' file per view and an 'index.json'.
+FORMATS = ['mosaic', 'png', 'jpg', 'npy', 'chunked']
+
+MOSAIC_NAME = 'large_FOV_sub_apertures.jpg'
+STACK_NAME = 'sub_apertures.npy'
+CHUNKED_DIR = 'sub_apertures'
+
+
+def view_name(p, q):
+    return 'view_{:02d}_{:02d}'.format(p, q)
+
+
+class MemmapArray():
+    """Numpy array backed by a '.npy' file, written in place by pool workers.
+
+    Like SharedArray, pickling only sends the path, and every process maps
+    the same file. Pages are flushed to disk as the workers write them,
+    so the parent never holds the array in memory.
+
+    Args:
+        path : Path of the '.npy' file. (created by 'MemmapArray.create')
+    """
+    def __init__(self, path):
+        self.path = path
+        self.array = np.load(path, mmap_mode='r+')
+
+    @classmethod
+    def create(cls, path, shape, dtype):
+        """Create a zero-filled '.npy' file of the given shape."""
+        np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape).flush()
+        return cls(path)
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    def close(self):
+        """Flush and unmap the file."""
+        self.array.flush()
+        self.array = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def save_view(view, path, quality=95):
+    """Encode one view. (PIL releases the GIL while encoding)"""
+    Image.fromarray(np.ascontiguousarray(view)).save(path, quality=quality)
+    return path
+
+
+def write_view_images(tiling, merged, output_dir, ext='png', workers=None):
+    """Write every merged view to its own image file, in parallel.
+
+    Args:
+        tiling     : TilingPlan of the merged views.
+        merged     : Merged views, as a mosaic or a stack.
+        output_dir : Output directory.
+        ext        : 'png' or 'jpg'.
+        workers    : Number of threads. (default: number of CPUs)
+    Returns:
+        paths      : Path of every view, row by row.
+    """
+    grid = tiling.view_grid(merged)
+    jobs = [(grid[i, :, j], os.path.join(output_dir, '{}.{}'.format(view_name(p, q), ext)))
+            for i, p in enumerate(tiling.view_rows) for j, q in enumerate(tiling.view_cols)]
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        return list(executor.map(lambda job: save_view(*job), jobs))
+
+
+def write_chunked(tiling, merged, output_dir, workers=None):
+    """Write every merged view to its own '.npy' file, in parallel.
+
+    'index.json' lists the view files, so a consumer can load a single view
+    with 'read_chunked_view' without decoding the others.
+
+    Args:
+        tiling     : TilingPlan of the merged views.
+        merged     : Merged views, as a mosaic or a stack.
+        output_dir : Output directory. (the chunks go to 'output_dir/sub_apertures')
+        workers    : Number of threads. (default: number of CPUs)
+    Returns:
+        chunk_dir  : Directory of the chunks.
+    """
+    chunk_dir = os.path.join(output_dir, CHUNKED_DIR)
+    os.makedirs(chunk_dir, exist_ok=True)
+
+    grid = tiling.view_grid(merged)
+    views = [(i, j, view_name(p, q) + '.npy')
+             for i, p in enumerate(tiling.view_rows) for j, q in enumerate(tiling.view_cols)]
+
+    def write_chunk(job):
+        i, j, name = job
+        np.save(os.path.join(chunk_dir, name), np.ascontiguousarray(grid[i, :, j]))
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+        list(executor.map(write_chunk, views))
+
+    index = {
+        'shape': list(tiling.view_shape) + [3],
+        'dtype': 'uint8',
+        'views': [[int(p), int(q)] for p, q in tiling.views],
+        'files': [name for _, _, name in views],
+    }
+    with open(os.path.join(chunk_dir, 'index.json'), 'w') as f:
+        json.dump(index, f, indent=2)
+    return chunk_dir
+
+
+def read_chunked_view(chunk_dir, p, q, mmap=True):
+    """Load one view written by 'write_chunked'.
+
+    Args:
+        chunk_dir : Directory of the chunks.
+        p, q      : Sub-aperture view.
+        mmap      : Memory-map the view instead of reading it.
+    Returns:
+        view      : View image, (height, width, 3).
+    """
+    with open(os.path.join(chunk_dir, 'index.json')) as f:
+        index = json.load(f)
+    name = index['files'][index['views'].index([p, q])]
+    return np.load(os.path.join(chunk_dir, name), mmap_mode='r' if mmap else None)
+
+
+def write_outputs(tiling, merged, output_dir, formats, workers=None):
+    """Write the merged views in every requested format.
+
+    The 'npy' stack is normally filled in place by the workers (see MemmapArray),
+    it is only written here when the views are held in memory.
+
+    Args:
+        tiling     : TilingPlan of the merged views.
+        merged     : Merged views, as a mosaic or a stack.
+        output_dir : Output directory.
+        formats    : Output formats. (see FORMATS)
+        workers    : Number of threads of the per-view writers.
+    Returns:
+        paths      : Written file or directory of every format.
+    """
+    paths = {}
+    if 'npy' in formats:
+        paths['npy'] = os.path.join(output_dir, STACK_NAME)
+        if not isinstance(merged, np.memmap):
+            np.save(paths['npy'], merged if merged.ndim == 4 else
+                    tiling.view_grid(merged).transpose(0, 2, 1, 3, 4).reshape(tiling.stack_shape))
+    if 'mosaic' in formats:
+        mosaic = merged if merged.ndim == 3 else \
+            tiling.view_grid(merged).reshape(tiling.merged_shape)
+        paths['mosaic'] = os.path.join(output_dir, MOSAIC_NAME)
+        Image.fromarray(mosaic).save(paths['mosaic'])
+    for ext in ('png', 'jpg'):
+        if ext in formats:
+            paths[ext] = write_view_images(tiling, merged, output_dir, ext, workers)
+    if 'chunked' in formats:
+        paths['chunked'] = write_chunked(tiling, merged, output_dir, workers)
+    return paths
@@ -0,0 +1,205 @@
+""" Pipelined batch mode of the large field-of-view integral imaging pickup system
+
+    python batch.py --inputs ./inputs/ --output_path ./results/
+
+Three stages run at the same time, connected by bounded queues:
+    depth  (thread)      : load image N+1 and predict its depth.
+    pickup (main thread) : pickup of image N on the worker pool.
+    write  (thread)      : write the outputs of image N-1.
+
+Outputs are written into '<name>.partial' and renamed to '<name>' once
+complete, so an interrupted batch resumes by skipping the finished images.
+"""
+
+import os
+import queue
+import shutil
+import hashlib
+import collections
+import threading
+import traceback
+
+import main
+from InIsystem.plan import PickupPlan
+from InIsystem.worker import worker_pool
+from InIsystem.profiler import Profiler
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+# Marks the end of the inputs in a queue.
+_DONE = object()
+
+
+def parse_args(argv=None):
+    parser = main.build_parser('Pipelined batch integral imaging pickup.')
+    parser.add_argument('--inputs', type=str, required=True,
+                        help='Directory of images, or manifest file of image paths. (one per line)')
+    parser.add_argument('--queue_size', type=int, default=1,
+                        help='Images waiting between two stages.')
+    parser.add_argument('--processes', type=int, default=4,
+                        help='Number of pickup workers.')
+    return parser.parse_args(argv)
+
+
+def list_inputs(source):
+    """Image paths of a directory (sorted), of a manifest file, or a single image.
+
+    Manifest lines are image paths, relative to the manifest directory.
+    Empty lines and lines starting with '#' are ignored, and so are repeated paths.
+    """
+    if os.path.isdir(source):
+        return [os.path.join(source, name) for name in sorted(os.listdir(source))
+                if name.lower().endswith(IMAGE_EXTENSIONS)]
+    if source.lower().endswith(IMAGE_EXTENSIONS):
+        return [source]
+
+    root = os.path.dirname(source)
+    with open(source) as f:
+        lines = [line.strip() for line in f]
+    paths, seen = [], set()
+    for line in lines:
+        if not line or line.startswith('#'):
+            continue
+        path = os.path.join(root, line)
+        if os.path.abspath(path) in seen:
+            print('Skip repeated input {}'.format(path))
+            continue
+        seen.add(os.path.abspath(path))
+        paths.append(path)
+    return paths
+
+
+def output_names(paths):
+    """Output directory name of every input.
+
+    The name is the image name, followed by a short hash of the image path
+    when several inputs share it (e.g. 'a/0001.png' and 'b/0001.png'), so
+    that no two inputs write to the same directory.
+
+    Args:
+        paths : Image paths.
+    Returns:
+        names : {path: output directory name}
+    """
+    names = {path: main.experiment_name(path) for path in paths}
+    counts = collections.Counter(names.values())
+    for path, name in names.items():
+        if counts[name] > 1:
+            digest = hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:8]
+            names[path] = '{}_{}'.format(name, digest)
+    return names
+
+
+def pending_inputs(paths, output_path, names=None):
+    """Inputs whose output directory does not exist yet."""
+    names = names or output_names(paths)
+    pending = [path for path in paths if not os.path.isdir(os.path.join(output_path, names[path]))]
+    if len(pending) < len(paths):
+        print('Skip {} images with existing outputs...'.format(len(paths) - len(pending)))
+    return pending
+
+
+def run_stage(name, func, source, sink):
+    """Apply 'func' to every item of 'source' and put the results in 'sink'.
+
+    An item whose stage fails is reported and dropped, the batch goes on.
+    """
+    while True:
+        item = source.get()
+        if item is _DONE:
+            if sink is not None:
+                sink.put(_DONE)
+            return
+        try:
+            result = func(*item)
+        except Exception:
+            print('[{}] {} failed:\n{}'.format(name, item[0], traceback.format_exc()))
+            continue
+        if sink is not None:
+            sink.put(result)
+
+
+def run_batch(paths, args, names=None):
+    """Run the pipelined pickup of every image.
+
+    Args:
+        paths : Image paths.
+        args  : Parsed options. (see parse_args)
+        names : Output directory name of every image. (see output_names)
+    Returns:
+        done  : Number of images written.
+    """
+    names = names or output_names(paths)
+    inputs = main.get_lens_params()
+    cache = main.open_depth_cache(args)
+    profiler = Profiler(enabled=args.profile)
+    written = []
+    # Tile grid of every image size and pickup plan of every tile shape, built once.
+    tilings, plans = {}, {}
+
+    def depth_stage(path):
+        image, depth = main.load_inputs(path, args, cache, profiler)
+        return path, image, depth
+
+    def pickup_stage(path, image, depth):
+        output_dir = os.path.join(args.output_path, names[path])
+        partial_dir = output_dir + '.partial'
+        # Left over by an interrupted batch.
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        os.makedirs(partial_dir)
+
+        print('Integral imaging pickup system... ({})'.format(path))
+        if image.shape not in tilings:
+            tilings[image.shape] = main.plan_pickup(image.shape, inputs, args)
+        tiling = tilings[image.shape]
+        if tiling.tile_shape not in plans:
+            plans[tiling.tile_shape] = PickupPlan.from_lens_params(inputs, tiling.tile_shape)
+        tiling, views = main.pickup_views(image, depth, inputs, partial_dir, args, pool, profiler,
+                                          tiling=tiling, plan=plans[tiling.tile_shape])
+        return path, tiling, views, partial_dir
+
+    def write_stage(path, tiling, views, partial_dir):
+        main.save_views(tiling, views, partial_dir, args.output_format, profiler)
+        os.replace(partial_dir, partial_dir[:-len('.partial')])
+        written.append(path)
+        print('Written {}'.format(path))
+
+    paths_queue = queue.Queue()
+    depth_queue = queue.Queue(maxsize=args.queue_size)
+    views_queue = queue.Queue(maxsize=args.queue_size)
+    for path in paths:
+        paths_queue.put((path,))
+    paths_queue.put(_DONE)
+
+    threads = [
+        threading.Thread(target=run_stage, args=('depth', depth_stage, paths_queue, depth_queue), daemon=True),
+        threading.Thread(target=run_stage, args=('write', write_stage, views_queue, None), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    with worker_pool(processes=args.processes) as pool:
+        run_stage('pickup', pickup_stage, depth_queue, views_queue)
+    for thread in threads:
+        thread.join()
+
+    if args.profile:
+        main.save_profile(profiler, args.output_path)
+    return len(written)
+
+
+def batch(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.output_path, exist_ok=True)
+
+    paths = list_inputs(args.inputs)
+    # Names over every input, so that they do not change when a batch resumes.
+    names = output_names(paths)
+    paths = pending_inputs(paths, args.output_path, names)
+    done = run_batch(paths, args, names)
+    print('{} / {} images written.'.format(done, len(paths)))
+
+
+if __name__ == '__main__':
+    batch()
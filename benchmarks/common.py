@@ -0,0 +1,84 @@
+""" Shared helpers of the benchmarks (synthetic inputs, timing, metrics) """
+
+import os
+import sys
+import time
+import hashlib
+import numpy as np
+
+from PIL import Image
+
+# Benchmarks are run from the repository root: python -m benchmarks.<name>
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def synthetic_inputs(height, width, seed=0):
+    """Generate a smooth synthetic RGB image and depth map.
+
+    Args:
+        height : Image height.
+        width  : Image width.
+        seed   : Random seed.
+    Returns:
+        color  : RGB image. (uint8)
+        depth  : Depth map in the network output range [10, 1000]. (float64)
+    """
+    rng = np.random.default_rng(seed)
+
+    coarse = rng.integers(0, 256, (max(height // 20, 2), max(width // 20, 2), 3), dtype=np.uint8)
+    color = np.asarray(Image.fromarray(coarse).resize((width, height), Image.BILINEAR))
+
+    coarse = rng.uniform(10, 1000, (max(height // 30, 2), max(width // 30, 2))).astype(np.float32)
+    depth = np.asarray(Image.fromarray(coarse).resize((width, height), Image.BILINEAR)).astype(np.float64)
+    return color, depth
+
+
+def timeit(func, *args, repeat=1, **kwargs):
+    """Run a function and measure its best wall time.
+
+    Args:
+        func   : Function to run.
+        repeat : Number of runs.
+    Returns:
+        result : Result of the last run.
+        best   : Best wall time in seconds.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def psnr(a, b, mask=None, peak=255.):
+    """Peak signal-to-noise ratio between two images.
+
+    Args:
+        a    : Image.
+        b    : Reference image.
+        mask : Pixels to compare. (default: all)
+        peak : Peak signal value.
+    Returns:
+        psnr : PSNR in dB. (inf for identical images)
+    """
+    diff = a.astype(np.float64) - b.astype(np.float64)
+    if mask is not None:
+        diff = diff[mask]
+    mse = np.mean(diff ** 2) if diff.size else 0.
+    return float('inf') if mse == 0 else float(10 * np.log10(peak ** 2 / mse))
+
+
+def digest(array):
+    """Fingerprint of an array, used to compare outputs with golden results.
+
+    Args:
+        array  : Numpy array.
+    Returns:
+        record : 'sha256' of the shape, dtype and bytes, plus 'shape', 'dtype' and 'mean'.
+    """
+    array = np.ascontiguousarray(array)
+    sha = hashlib.sha256('{}{}'.format(array.shape, array.dtype.str).encode())
+    sha.update(array.data)
+    return {'sha256': sha.hexdigest(), 'shape': list(array.shape),
+            'dtype': array.dtype.str, 'mean': float(array.mean()) if array.size else 0.}
@@ -0,0 +1,94 @@
+""" Compare the float depth model with exported artifacts on CPU
+
+Every model runs in its own process, so peak memory is not shared.
+
+    python -m benchmarks.depth_export --model_path ./monodepth/model.h5 \\
+        --artifacts ./monodepth/model_fp16.tflite ./monodepth/model_int8.tflite
+"""
+
+import os
+import json
+import time
+import argparse
+import resource
+import multiprocessing
+import numpy as np
+
+# Puts the repository root on sys.path.
+import benchmarks.common
+
+
+def run_model(model_path, image_paths, repeat, xla=False):
+    """Load a model and time it on the given images. (runs in a child process)
+
+    Returns:
+        result : Load time, latencies, peak RSS (MB) and predicted depth maps.
+    """
+    # CPU only: hide the GPUs before TensorFlow is imported.
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    import monodepth.depth_estimator as estimator
+
+    model = estimator.DepthEstimator(model_path, xla=xla)
+    depths, latencies = [], []
+    for path in image_paths:
+        net_input, (height, width) = estimator.load_network_input(path)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            depth = model.predict(net_input[None], height, width)
+            latencies.append(time.perf_counter() - start)
+        depths.append(depth)
+
+    return {
+        'load_time': model.load_time,
+        'warmup_time': model.warmup_time,
+        'mean_latency': float(np.mean(latencies)),
+        'p95_latency': float(np.percentile(latencies, 95)),
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'depths': depths,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Depth model export benchmark.')
+    parser.add_argument('--model_path', type=str, default='./monodepth/model.h5',
+                        help='Trained (float) model file, the reference.')
+    parser.add_argument('--artifacts', type=str, nargs='*', default=[],
+                        help='Exported artifacts. (.tflite files or SavedModel directories)')
+    parser.add_argument('--xla', action='store_true', help='Also benchmark the XLA-compiled float model.')
+    parser.add_argument('--images', type=str, default='./inputs/', help='Sample images.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per image.')
+    parser.add_argument('--output', type=str, default=None, help='Write the results as JSON.')
+    args = parser.parse_args()
+
+    # Listed here rather than with monodepth.depth_estimator, to keep TensorFlow out of this process.
+    image_paths = [os.path.join(args.images, name) for name in sorted(os.listdir(args.images))
+                   if name.lower().endswith(('.jpg', '.jpeg', '.png'))] \
+        if os.path.isdir(args.images) else [args.images]
+
+    runs = [(args.model_path, False)] + [(path, False) for path in args.artifacts]
+    if args.xla:
+        runs.append((args.model_path, True))
+
+    context = multiprocessing.get_context('spawn')
+    results, reference = {}, None
+    for path, xla in runs:
+        with context.Pool(processes=1) as pool:
+            result = pool.apply(run_model, (path, image_paths, args.repeat, xla))
+
+        depths = result.pop('depths')
+        if reference is None:
+            reference = depths
+        else:
+            errors = [np.abs(d - r) / r for d, r in zip(depths, reference)]
+            result['mean_abs_rel_error'] = float(np.mean([e.mean() for e in errors]))
+            result['max_abs_rel_error'] = float(np.max([e.max() for e in errors]))
+        results[path + (' (xla)' if xla else '')] = result
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+""" Compare hole filling methods (speed and PSNR against Navier-Stokes)
+
+    python -m benchmarks.fill_methods --tile 150 --num_of_lenses 100
+"""
+
+import json
+import argparse
+
+from benchmarks.common import synthetic_inputs, timeit, psnr
+
+import InIsystem.convert as cvt
+import InIsystem.pickup as pickup
+import InIsystem.holefill as holefill
+import InIsystem.subaperture as sub
+import utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hole filling benchmark.')
+    parser.add_argument('--tile', type=int, default=150, help='Size of the synthetic tile.')
+    parser.add_argument('--num_of_lenses', type=int, default=100, help='Number of lenses.')
+    parser.add_argument('--P_L', type=int, default=15, help='Size of elemental lens.')
+    parser.add_argument('--f', type=float, default=10, help='Focal length of elemental lens.')
+    parser.add_argument('--g', type=float, default=11, help='Gap between lens and display.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement.')
+    parser.add_argument('--output', type=str, default=None, help='Write the results as JSON.')
+    args = parser.parse_args()
+
+    color, depth = synthetic_inputs(args.tile, args.tile)
+    _, P_I, _, L = cvt.convert_depth(depth, args.f, args.g, 1, args.P_L)
+    EIA = pickup.render_EIA_CPU(color, L, args.P_L, P_I, args.g, args.num_of_lenses)
+    holes = utils.hole_mask(EIA)
+
+    results = {'tile': args.tile, 'num_of_lenses': args.num_of_lenses,
+               'hole_ratio': float(holes.mean()), 'EIA': {}, 'sub_apertures': {}}
+
+    reference = None
+    for method in holefill.METHODS:
+        (filled, stats), seconds = timeit(pickup.inpaint_EIA, EIA, args.num_of_lenses, args.P_L,
+                                          method, repeat=args.repeat)
+        reference = filled if reference is None else reference
+        results['EIA'][method] = {'seconds': seconds, 'stats': stats,
+                                  'psnr_vs_ns': None if filled is reference else psnr(filled, reference, holes)}
+
+    # Views of the unfilled EIA, so that the sub-aperture images have holes too.
+    views = sub.extract_sub_apertures(EIA, args.P_L, args.num_of_lenses)
+    view_holes = utils.hole_mask(sub.extract_sub_apertures(EIA, args.P_L, args.num_of_lenses, copy=True))
+    results['sub_apertures']['hole_ratio'] = float(view_holes.mean())
+
+    reference = None
+    for method in holefill.METHODS:
+        filled, seconds = timeit(sub.inpaint_sub_apertures, views, method=method, repeat=args.repeat)
+        reference = filled if reference is None else reference
+        results['sub_apertures'][method] = {'seconds': seconds,
+                                            'psnr_vs_ns': None if filled is reference else psnr(filled, reference, view_holes)}
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
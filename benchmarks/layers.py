@@ -0,0 +1,60 @@
+""" Error and speed of the depth-layered renderer for each number of depth planes
+
+    python -m benchmarks.layers --tile 150 --num_of_lenses 100 --layers 1 2 4 8 16 32 64
+
+The exact per-pixel references are the CPU scatter renderer and the
+gather renderer. PSNR is measured where neither image has a pickup hole.
+"""
+
+import json
+import argparse
+
+from benchmarks.common import synthetic_inputs, timeit, psnr
+
+import InIsystem.convert as cvt
+import InIsystem.pickup as pickup
+import InIsystem.gather as gather
+import InIsystem.layered as layered
+import utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Depth-layered renderer benchmark.')
+    parser.add_argument('--tile', type=int, default=150, help='Size of the synthetic tile.')
+    parser.add_argument('--num_of_lenses', type=int, default=100, help='Number of lenses.')
+    parser.add_argument('--P_L', type=int, default=15, help='Size of elemental lens.')
+    parser.add_argument('--f', type=float, default=10, help='Focal length of elemental lens.')
+    parser.add_argument('--g', type=float, default=11, help='Gap between lens and display.')
+    parser.add_argument('--layers', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64],
+                        help='Numbers of depth planes K.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement.')
+    parser.add_argument('--output', type=str, default=None, help='Write the results as JSON.')
+    args = parser.parse_args()
+
+    color, depth = synthetic_inputs(args.tile, args.tile)
+    _, P_I, _, L = cvt.convert_depth(depth, args.f, args.g, 1, args.P_L)
+    render_args = (color, L, args.P_L, P_I, args.g, args.num_of_lenses)
+
+    references = {}
+    results = {'tile': args.tile, 'num_of_lenses': args.num_of_lenses, 'references': {}, 'layered': {}}
+    for name, render in [('scatter', pickup.render_EIA_CPU), ('gather', gather.render_EIA_gather)]:
+        EIA, seconds = timeit(render, *render_args, repeat=args.repeat)
+        references[name] = (EIA, utils.hole_mask(EIA))
+        results['references'][name] = {'seconds': seconds, 'hole_ratio': float(references[name][1].mean())}
+
+    for K in args.layers:
+        EIA, seconds = timeit(layered.render_EIA_layered, *render_args, num_of_layers=K, repeat=args.repeat)
+        holes = utils.hole_mask(EIA)
+        result = {'seconds': seconds, 'hole_ratio': float(holes.mean())}
+        for name, (reference, reference_holes) in references.items():
+            result['psnr_vs_' + name] = psnr(EIA, reference, ~holes & ~reference_holes)
+        results['layered'][K] = result
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+""" Straight ports of the original pipeline stages, the source of the golden results
+
+These follow the code of the first version of the repository: the PyCUDA
+kernel (one object pixel at a time, every lens), the per-lens inpainting,
+the per-view sub-aperture loops and the hstack / vstack merge. They are
+slow and only run by 'python -m benchmarks.stages --update_golden', so the
+golden results check the optimized stages against the original behaviour
+and not against themselves.
+"""
+
+import cv2
+import numpy as np
+
+import utils
+
+
+def render_EIA_reference(color, L, P_L, P_I, g, num_of_lenses):
+    """Port of the 'generate_EIA' CUDA kernel, in float32.
+
+    The kernel threads race where several object pixels hit the same EIA
+    cell, here the object pixels run in raster order so the last one wins
+    (the rule of pickup.render_EIA_CPU). The lenses of one object pixel
+    keep the (i, j) loop order of the kernel.
+    """
+    f32 = np.float32
+    height, width, _ = color.shape
+    elem_plane_w = num_of_lenses * P_L
+
+    pixel_coords = utils.generate_coords(height, width, L, is_depth=True)
+    pixel_x = pixel_coords[0].astype(f32).ravel()
+    pixel_y = pixel_coords[1].astype(f32).ravel()
+    pixel_L = pixel_coords[2].astype(f32).ravel()
+
+    lens_loc = utils.generate_coords(num_of_lenses, num_of_lenses)
+    elem_coords = utils.generate_coords(elem_plane_w, elem_plane_w)
+
+    i, j = np.meshgrid(np.arange(num_of_lenses), np.arange(num_of_lenses), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    lens_x = lens_loc[0].astype(f32).ravel()[i + j * num_of_lenses]
+    lens_y = lens_loc[1].astype(f32).ravel()[i + j * num_of_lenses]
+    lens_min_x = elem_coords[0].astype(f32).ravel()[i * P_L + j * P_L * elem_plane_w]
+    lens_min_y = elem_coords[1].astype(f32).ravel()[i * P_L + j * P_L * elem_plane_w]
+
+    P_L_, P_I_, g_ = f32(P_L), f32(P_I), f32(g)
+    half_elem = f32(elem_plane_w // 2)
+    half_h, half_w = f32(height // 2), f32(width // 2)
+
+    R, G, B = [color[:, :, k].astype(f32).ravel() for k in range(3)]
+    elem = np.zeros((elem_plane_w * elem_plane_w, 3), dtype=f32)
+    for p in range(height * width):
+        u = P_L_ * lens_x - ((pixel_x[p] * P_I_) - (P_L_ * lens_x)) * (g_ / pixel_L[p])
+        v = P_L_ * lens_y - ((pixel_y[p] * P_I_) - (P_L_ * lens_y)) * (g_ / pixel_L[p])
+
+        hit = (lens_min_x <= u) & (u <= lens_min_x + P_L_) & (lens_min_y <= v) & (v <= lens_min_y + P_L_)
+        # (int) casts truncate toward zero.
+        u = (u[hit] + half_elem).astype(np.int32)
+        v = (v[hit] + half_elem).astype(np.int32)
+        inside = (0 <= u) & (u < elem_plane_w) & (0 <= v) & (v < elem_plane_w)
+
+        p_i = int(pixel_x[p] + half_w)
+        p_j = int(pixel_y[p] + half_h)
+        src = p_i + p_j * width
+        elem[u[inside] + v[inside] * elem_plane_w] = (R[src], G[src], B[src])
+
+    return elem.reshape(elem_plane_w, elem_plane_w, 3).astype(np.uint8)
+
+
+def inpainting_reference(EIA, num_of_lenses, P_L):
+    """Port of the original per-lens EIA inpainting."""
+    inpainted_EIA = EIA.copy()
+    for i in range(num_of_lenses):
+        for j in range(num_of_lenses):
+            elem = EIA[i * P_L:i * P_L + P_L, j * P_L:j * P_L + P_L]
+            gray = cv2.cvtColor(elem, cv2.COLOR_RGB2GRAY)
+
+            _, thresh = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
+            mask = cv2.bitwise_not(thresh)
+
+            inpainted = cv2.inpaint(elem, mask, 5, cv2.INPAINT_NS)
+            inpainted_EIA[i * P_L:i * P_L + P_L, j * P_L:j * P_L + P_L] = inpainted
+    return inpainted_EIA
+
+
+def inpaint_view_reference(sub_aperture):
+    gray = cv2.cvtColor(sub_aperture, cv2.COLOR_RGB2GRAY)
+
+    _, thresh = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
+    mask = cv2.bitwise_not(thresh)
+    return cv2.inpaint(sub_aperture, mask, 3, cv2.INPAINT_NS)
+
+
+def sub_apertures_reference(elem_plane, P_L, num_of_lenses, rows, cols):
+    """Port of the original sub-aperture loops, for the grid of views rows x cols.
+
+    The original extracted all P_L x P_L views, the optimized stage only the
+    selected ones: the views are laid out the same way, one grid row per view row.
+    """
+    sub_apertures = np.zeros((len(rows) * num_of_lenses, len(cols) * num_of_lenses, 3), dtype=np.uint8)
+    sub_aperture = np.zeros((num_of_lenses, num_of_lenses, 3))
+
+    for grid_i, elem_i in enumerate(rows):
+        for grid_j, elem_j in enumerate(cols):
+            for i in range(num_of_lenses):
+                for j in range(num_of_lenses):
+                    sub_aperture[i, j, :] = elem_plane[elem_i + (i * P_L), elem_j + (j * P_L), :]
+
+            y_start = grid_i * num_of_lenses
+            x_start = grid_j * num_of_lenses
+            sub_apertures[y_start:y_start + num_of_lenses, x_start:x_start + num_of_lenses] = \
+                inpaint_view_reference(sub_aperture.astype(np.uint8))
+    return sub_apertures
+
+
+def merge_reference(outputs, tiling):
+    """Port of the original hstack / vstack merge.
+
+    The original crop offsets (265 and 333) were hard-coded for 1200 x 700
+    inputs, the crops here come from the tile grid. (see tiling.merge_offsets)
+    """
+    N = tiling.num_of_lenses
+    num_of_cols = len(tiling.col_origins)
+    view_h, view_w = tiling.view_shape
+
+    merged = np.zeros(tiling.merged_shape, dtype=np.uint8)
+    for i in range(tiling.grid[0]):
+        for j in range(tiling.grid[1]):
+            i_start, j_start = i * N, j * N
+
+            bands = []
+            for tile_row, row_src in enumerate(tiling.row_src):
+                band = np.hstack([
+                    outputs[tile_row * num_of_cols + tile_col][i_start:i_start + N, j_start + col_src:j_start + N]
+                    for tile_col, col_src in enumerate(tiling.col_src)])
+                bands.append(band[row_src:])
+
+            merged[i * view_h:(i + 1) * view_h, j * view_w:(j + 1) * view_w] = np.vstack(bands)
+    return merged
@@ -0,0 +1,233 @@
+""" Time every stage of the pickup pipeline on synthetic inputs (no GPU or model needed)
+
+    python -m benchmarks.stages --tile 150 --num_of_lenses 100 --output stages.json
+
+Every output is fingerprinted and compared with 'benchmarks/golden.json', so a
+faster implementation can be checked to give the same result. Golden results
+are keyed by the configuration; '--update_golden' records them from the ports
+of the original code in 'benchmarks/reference.py'. Renderers added since
+('gather', 'layered') have no original counterpart, their golden results are
+recorded from the current code and marked 'source': 'current'.
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+
+from benchmarks.common import synthetic_inputs, timeit, digest
+import benchmarks.reference as reference
+
+import InIsystem.convert as cvt
+import InIsystem.pickup as pickup
+import InIsystem.subaperture as sub
+from InIsystem.tiling import TilingPlan
+from main import merge_sub_apertures
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden.json')
+
+# Scatter on the GPU is racy where several object pixels hit the same EIA pixel.
+NONDETERMINISTIC = {'render_gpu'}
+
+# Smallest share of EIA cells where the GPU and CPU renderers must agree (they only
+# differ on cells contested by several object pixels).
+MIN_GPU_AGREEMENT = 0.99
+
+
+def available_backends():
+    """Pickup backends usable on this host, and the reason of the others."""
+    backends, skipped = [], {}
+    for backend in sorted(pickup.RENDERERS):
+        if backend == 'gpu':
+            try:
+                import pycuda.autoinit  # noqa: F401
+            except Exception as e:
+                skipped[backend] = '{}: {}'.format(type(e).__name__, e)
+                continue
+        backends.append(backend)
+    return backends, skipped
+
+
+def config_key(args):
+    return 'tile={} lenses={} P_L={} f={} g={} views={} seed={}'.format(
+        args.tile, args.num_of_lenses, args.P_L, args.f, args.g, args.views, args.seed)
+
+
+def central_views(args):
+    start = (args.P_L - args.views) // 2
+    return range(start, start + args.views), range(start, start + args.views)
+
+
+def benchmark_tiling(args, P_I, views):
+    # A 2 x 2 grid of tiles, all with the same views.
+    return TilingPlan(args.tile + args.tile // 3, args.tile + args.tile // 3,
+                      args.num_of_lenses, args.P_L, P_I, views)
+
+
+def cell_agreement(EIA, expected):
+    """Share of the EIA cells equal in both arrays."""
+    return float(np.mean((EIA == expected).all(axis=-1)))
+
+
+def run_stages(args, backends):
+    """Run and time each stage on its own.
+
+    Returns:
+        results : {stage: {'seconds', 'output'}} where 'output' is a digest.
+    """
+    results = {}
+
+    def record(stage, func, *func_args, **kwargs):
+        output, seconds = timeit(func, *func_args, repeat=args.repeat, **kwargs)
+        result = output[-1] if stage == 'convert_depth' else output
+        results[stage] = {'seconds': seconds, 'output': digest(result)}
+        print('{:<24} {:8.3f} s'.format(stage, seconds))
+        return output
+
+    color, depth = synthetic_inputs(args.tile, args.tile, args.seed)
+    _, P_I, _, L = record('convert_depth', cvt.convert_depth, depth, args.f, args.g, 1, args.P_L)
+
+    EIA = None
+    rendered = {}
+    for backend in backends:
+        rendered[backend] = record('render_' + backend, pickup.RENDERERS[backend],
+                                   color, L, args.P_L, P_I, args.g, args.num_of_lenses)
+        if backend == 'cpu' or EIA is None:
+            EIA = rendered[backend]
+
+    # The default tile (150) is not a multiple of the 20 x 20 CUDA blocks, so this also
+    # checks that the kernel covers the last rows and columns of the tile. The renderers
+    # are compared on a tile of the other parity too: odd tiles have fractional pixel
+    # coordinates. (see plan.source_index)
+    if 'gpu' in rendered and 'cpu' in rendered:
+        agreements = {args.tile: cell_agreement(rendered['gpu'], rendered['cpu'])}
+        other = args.tile + 1
+        other_color, other_depth = synthetic_inputs(other, other, args.seed)
+        _, _, _, other_L = cvt.convert_depth(other_depth, args.f, args.g, 1, args.P_L)
+        agreements[other] = cell_agreement(
+            pickup.render_EIA_GPU(other_color, other_L, args.P_L, P_I, args.g, args.num_of_lenses),
+            pickup.render_EIA_CPU(other_color, other_L, args.P_L, P_I, args.g, args.num_of_lenses))
+
+        results['render_gpu']['agreement_vs_cpu'] = min(agreements.values())
+        for size, agreement in agreements.items():
+            print('{:<24} {:8.4f} of the cells agree with the CPU renderer ({} px tile)'.format(
+                'render_gpu', agreement, size))
+
+    EIA = record('inpainting', pickup.inpainting, EIA, args.num_of_lenses, args.P_L)
+
+    views = central_views(args)
+    sub_apertures = record('generate_sub_apertures', sub.generate_sub_apertures,
+                           EIA, args.P_L, args.num_of_lenses, views=views)
+
+    tiling = benchmark_tiling(args, P_I, views)
+    record('merge_sub_apertures', merge_sub_apertures, [sub_apertures] * len(tiling), tiling)
+    return results
+
+
+def reference_outputs(args):
+    """Digests of the stages run by the ports of the original code. (see benchmarks/reference.py)
+
+    Returns:
+        outputs : {stage: digest}, 'render_cpu' stands for the original CUDA kernel.
+    """
+    color, depth = synthetic_inputs(args.tile, args.tile, args.seed)
+    # convert_depth is unchanged since the original code.
+    _, P_I, _, L = cvt.convert_depth(depth, args.f, args.g, 1, args.P_L)
+    outputs = {'convert_depth': digest(L)}
+
+    print('Original kernel...')
+    EIA = reference.render_EIA_reference(color, L, args.P_L, P_I, args.g, args.num_of_lenses)
+    outputs['render_cpu'] = digest(EIA)
+
+    EIA = reference.inpainting_reference(EIA, args.num_of_lenses, args.P_L)
+    outputs['inpainting'] = digest(EIA)
+
+    views = central_views(args)
+    sub_apertures = reference.sub_apertures_reference(EIA, args.P_L, args.num_of_lenses, *views)
+    outputs['generate_sub_apertures'] = digest(sub_apertures)
+
+    tiling = benchmark_tiling(args, P_I, views)
+    outputs['merge_sub_apertures'] = digest(reference.merge_reference([sub_apertures] * len(tiling), tiling))
+    return outputs
+
+
+def check_golden(results, golden):
+    """Compare each output fingerprint with the golden one.
+
+    Returns:
+        failed : Stages whose output differs.
+    """
+    failed = []
+    for stage, result in results.items():
+        if 'agreement_vs_cpu' in result:
+            agreement = result['agreement_vs_cpu']
+            result['golden'] = 'skipped (nondeterministic), {:.4f} agreement with render_cpu'.format(agreement)
+            if agreement < MIN_GPU_AGREEMENT:
+                failed.append(stage)
+        elif stage in NONDETERMINISTIC:
+            result['golden'] = 'skipped (nondeterministic)'
+        elif stage not in golden:
+            result['golden'] = 'missing'
+        elif golden[stage]['sha256'] == result['output']['sha256']:
+            result['golden'] = 'match'
+        else:
+            result['golden'] = 'MISMATCH (mean {} vs golden {})'.format(
+                result['output']['mean'], golden[stage]['mean'])
+            failed.append(stage)
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pipeline stage benchmark.')
+    parser.add_argument('--tile', type=int, default=150, help='Size of the synthetic tile.')
+    parser.add_argument('--num_of_lenses', type=int, default=100, help='Number of lenses.')
+    parser.add_argument('--P_L', type=int, default=15, help='Size of elemental lens.')
+    parser.add_argument('--f', type=float, default=10, help='Focal length of elemental lens.')
+    parser.add_argument('--g', type=float, default=11, help='Gap between lens and display.')
+    parser.add_argument('--views', type=int, default=7, help='Rows / columns of the central sub-aperture views.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic inputs.')
+    parser.add_argument('--backends', type=str, nargs='+', default=None,
+                        help='Pickup backends to time. (default: every available one)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement.')
+    parser.add_argument('--output', type=str, default=None, help='Write the results as JSON.')
+    parser.add_argument('--golden', type=str, default=GOLDEN_PATH, help='Golden results file.')
+    parser.add_argument('--update_golden', action='store_true',
+                        help='Record the golden results from the original code. (see benchmarks/reference.py)')
+    args = parser.parse_args()
+
+    backends, skipped = available_backends()
+    if args.backends:
+        backends = [backend for backend in args.backends if backend in backends]
+
+    results = run_stages(args, backends)
+
+    golden = {}
+    if os.path.exists(args.golden):
+        with open(args.golden) as f:
+            golden = json.load(f)
+    key = config_key(args)
+
+    if args.update_golden:
+        golden[key] = {stage: dict(output, source='original')
+                       for stage, output in reference_outputs(args).items()}
+        for stage, result in results.items():
+            if stage not in golden[key] and stage not in NONDETERMINISTIC:
+                golden[key][stage] = dict(result['output'], source='current')
+        with open(args.golden, 'w') as f:
+            json.dump(golden, f, indent=2, sort_keys=True)
+        failed = []
+    else:
+        failed = check_golden(results, golden.get(key, {}))
+
+    report = {'config': key, 'skipped_backends': skipped, 'stages': results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if failed:
+        raise SystemExit('Outputs differ from the golden results: ' + ', '.join(failed))
+
+
+if __name__ == '__main__':
+    main()
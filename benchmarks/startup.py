@@ -0,0 +1,86 @@
+""" Measure the import time and the start-up cost of the pickup workers
+
+    python -m benchmarks.startup --processes 4
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import multiprocessing
+
+import benchmarks.common  # noqa: F401 (repository root on sys.path)
+
+from InIsystem.memory import MB, current_rss
+from InIsystem.worker import worker_pool
+
+IMPORT_PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+try:
+    import {module}
+    error = None
+except Exception as e:
+    error = '{{}}: {{}}'.format(type(e).__name__, e)
+seconds = time.perf_counter() - start
+from InIsystem.memory import current_rss
+print(json.dumps({{'seconds': seconds, 'rss_mb': current_rss() / (1 << 20), 'modules': len(sys.modules),
+                  'tensorflow': 'tensorflow' in sys.modules, 'error': error}}))
+'''
+
+# Long enough for every worker to take one task.
+PING_SECONDS = 0.2
+
+
+def import_cost(module):
+    """Import time and resident memory of a module in a fresh interpreter."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, '-c', IMPORT_PROBE.format(module=module)],
+                            cwd=root, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def ping(_):
+    time.sleep(PING_SECONDS)
+    return {'pid': os.getpid(), 'rss_mb': current_rss() / MB, 'modules': len(sys.modules),
+            'tensorflow': 'tensorflow' in sys.modules}
+
+
+def pool_startup(make_pool, processes):
+    """Time from creating a pool to every worker answering a task."""
+    start = time.perf_counter()
+    with make_pool(processes) as pool:
+        answers = pool.map(ping, range(processes), chunksize=1)
+        seconds = time.perf_counter() - start - PING_SECONDS
+    workers = {answer['pid']: answer for answer in answers}
+    return {'seconds': seconds, 'workers': len(workers),
+            'rss_mb': [round(w['rss_mb'], 1) for w in workers.values()],
+            'modules': max(w['modules'] for w in workers.values()),
+            'tensorflow': any(w['tensorflow'] for w in workers.values())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Worker start-up benchmark.')
+    parser.add_argument('--processes', type=int, default=4, help='Number of pool workers.')
+    parser.add_argument('--output', type=str, default=None, help='Write the results as JSON.')
+    args = parser.parse_args()
+
+    results = {
+        'import': {module: import_cost(module)
+                   for module in ['InIsystem.worker', 'main', 'monodepth.depth_estimator']},
+        'pool': {
+            'spawn': pool_startup(multiprocessing.get_context('spawn').Pool, args.processes),
+            'worker_pool': pool_startup(worker_pool, args.processes),
+        },
+    }
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
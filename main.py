@@ -1,41 +1,96 @@
 import os
 import argparse
 import numpy as np
-import tensorflow as tf
-import multiprocessing
 
-from PIL import Image
 from functools import partial
 
-import monodepth.depth_estimator as estimator
-import InIsystem.convert as cvt
-import InIsystem.pickup as pickup
-import InIsystem.subaperture as sub
+import monodepth.preprocess as preprocess
+from monodepth.depth_cache import DepthCache
+from InIsystem.plan import PickupPlan
+from InIsystem.shared import SharedArray
+from InIsystem.tiling import TilingPlan
+import InIsystem.writers as writers
+from InIsystem.profiler import Profiler
+from InIsystem.memory import MB, estimate_pickup_memory, check_memory_budget
+from InIsystem.worker import MERGED_VIEWS, worker_pool, multiprocess_shared
 
 import utils
 
 
-parser = argparse.ArgumentParser(description='Large field-of-view integral imaging pickup system.')
-parser.add_argument('--color_path', type=str,
-                    default='./inputs/test.jpg', help='Path of input image.')
-parser.add_argument('--output_path', type=str,
-                    default='./results/', help='Output root directory.')
+def build_parser(description='Large field-of-view integral imaging pickup system.'):
+    """Options of the pickup pipeline, shared by main.py and batch.py."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--output_path', type=str,
+                        default='./results/', help='Output root directory.')
 
-parser.add_argument('--model_path', type=str,
-                    default='./monodepth/model.h5', help='Model file for predicting a depth.')
+    parser.add_argument('--output_format', type=str, nargs='+', default=['mosaic'], choices=writers.FORMATS,
+                        help='Output formats of the large FOV sub-aperture images.')
 
-parser.add_argument('--is_gpu', action='store_true',
-                    help='Select GPU or Not.')
+    parser.add_argument('--model_path', type=str,
+                        default='./monodepth/model.h5', help='Model file for predicting a depth.')
 
-args = parser.parse_args()
+    parser.add_argument('--native_size', action='store_true',
+                        help='Process the input image at its native size instead of 1200 x 700.')
+    parser.add_argument('--max_stride', type=int, default=None,
+                        help='Largest stride between tiles in pixels. (default: a third of a tile)')
 
+    parser.add_argument('--depth_cache', type=str, default=None,
+                        help='Directory of the depth map cache. (default: no cache)')
+    parser.add_argument('--depth_cache_size', type=int, default=2048,
+                        help='Size cap of the depth map cache in MB.')
 
-def get_depth_map(color, model_path):
+    parser.add_argument('--is_gpu', action='store_true',
+                        help='Select GPU or Not.')
+    parser.add_argument('--backend', type=str, default=None, choices=['gpu', 'cpu', 'gather', 'layered', 'direct'],
+                        help='Elemental image renderer. (default: gpu with --is_gpu, cpu otherwise)')
+    parser.add_argument('--fill_method', type=str, default='ns', choices=['ns', 'pullpush'],
+                        help='Hole filling method of elemental / sub-aperture images.')
+
+    parser.add_argument('--memory_budget', type=int, default=None,
+                        help='Memory budget of each pickup worker in MB, checked before starting.')
+    parser.add_argument('--memory_report', action='store_true',
+                        help='Print the peak RSS of each pickup stage.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Trace every stage, written to profile.json and trace.json (Chrome trace).')
+    return parser
+
+
+def parse_args(argv=None):
+    """Parse the command line. (not at import time, so pool workers importing this module skip it)"""
+    parser = build_parser()
+    parser.add_argument('--color_path', type=str,
+                        default='./inputs/test.jpg', help='Path of input image.')
+    return parser.parse_args(argv)
+
+
+def load_estimator():
+    """Import TensorFlow and the depth estimation model on first use.
+
+    Returns:
+        estimator : monodepth.depth_estimator module.
+    """
+    import tensorflow as tf
+
+    gpus = tf.config.experimental.list_physical_devices('GPU')
+    if gpus:
+        try:
+            tf.config.experimental.set_virtual_device_configuration(
+                gpus[0],
+                [tf.config.experimental.VirtualDeviceConfiguration(memory_limit=3072)])
+        except RuntimeError as e:
+            print(e)
+
+    import monodepth.depth_estimator as estimator
+    return estimator
+
+
+def get_depth_map(color, model_path, cache=None):
     """Predict a depth map from a single RGB image.
 
     Args:
         color      : Input color image.
         model_path : Deep learning depth estimation model file path.
+        cache      : DepthCache. On a hit, TensorFlow is not even imported.
     Returns:
         depth      : Predicted a depth image corresponding a input RGB image.
     """
@@ -43,10 +98,21 @@ def get_depth_map(color, model_path):
 
     # if color height != 480 and color width != 640, Resize the input image.
     if height != 480 and width != 640:
-        color = estimator.resize_image(color)
+        color = preprocess.resize_image(color)
+
+    if cache is not None:
+        key = cache.key(color, model_path, height, width)
+        depth = cache.get(key)
+        if depth is not None:
+            print('Depth map loaded from cache...')
+            return depth
 
-    net_input = estimator.preprocess_image(color)
+    estimator = load_estimator()
+    net_input = preprocess.preprocess_image(color)
     depth = estimator.estimate_depth(net_input, height, width, model_path)
+
+    if cache is not None:
+        cache.put(key, depth)
     return depth
 
 
@@ -71,118 +137,179 @@ def get_lens_params():
     return inputs
 
 
-def merge_sub_apertures(outputs, num_of_lenses):
+def merge_sub_apertures(outputs, tiling):
     """Merge sub-aperture images to generate large FOV images.
 
     Args:
         outputs            : Sub-aperture image array from integral imaging system about each part of images.
-        num_of_lenses      : Number of elemental lens.
+        tiling             : TilingPlan the parts of images come from.
     Returns:
         LFOV_sub_apertures : Large field-of-view sub-aperture image array.
     """
     print('Generate large FOV sub-aperture image array...')
-    LFOV_sub_apertures = np.zeros((467 * 7, 805 * 7, 3))
-    for i in range(7):
-        for j in range(7):
-            i_start = i * num_of_lenses
-            i_end = i * num_of_lenses + num_of_lenses
-            j_start = j * num_of_lenses
-            j_end = j * num_of_lenses + num_of_lenses
-
-            rows = np.hstack([
-                outputs[0][i_start:i_end, j_start:j_end],
-                outputs[1][i_start:i_end, j_start + 265:j_end],
-                outputs[2][i_start:i_end, j_start + 265:j_end],
-                outputs[3][i_start:i_end, j_start + 265:j_end]
-            ])
-
-            cols = np.hstack([
-                outputs[4][i_start:i_end, j_start:j_end],
-                outputs[5][i_start:i_end, j_start + 265:j_end],
-                outputs[6][i_start:i_end, j_start + 265:j_end],
-                outputs[7][i_start:i_end, j_start + 265:j_end]
-            ])
-
-            lfov = np.vstack([
-                rows,
-                cols[333:, :]
-            ])
-            LFOV_sub_apertures[i * 467:i * 467 + 467, j * 805:j * 805 + 805] = lfov
-    return LFOV_sub_apertures
-
-
-def multiprocess_ini(inputs, data):
-    """Multi-process integral imaging pickup system for each part of images.
+    return tiling.merge(outputs)
+
+
+def experiment_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def open_depth_cache(args):
+    if not args.depth_cache:
+        return None
+    return DepthCache(args.depth_cache, args.depth_cache_size << 20)
+
+
+def load_inputs(path, args, cache=None, profiler=None):
+    """Load an input RGB image and predict its depth image.
+
+    Args:
+        path     : Image path.
+        args     : Parsed options. (see build_parser)
+        cache    : DepthCache.
+        profiler : Profiler recording the stages.
+    Returns:
+        image    : RGB image.
+        depth    : Depth image.
+    """
+    profiler = profiler or Profiler(enabled=False)
+    with profiler.stage('load_image', image=path):
+        image = utils.load_image(path, None if args.native_size else (1200, 700))
+    with profiler.stage('depth_inference', image=path):
+        depth = get_depth_map(image, args.model_path, cache)
+    return image, depth
+
+
+def plan_pickup(image_shape, inputs, args):
+    """Tile grid of an image, after checking the memory budget of a pickup worker.
+
+    Called before the worker pool starts, so an over-budget run fails without spawning it.
 
     Args:
-        inputs        : Parameter for integarl imaging pickup system.
-        data          : RGB image and depth image data.
+        image_shape : (height, width[, 3]) of the input image.
+        inputs      : Parameter for integarl imaging pickup system.
+        args        : Parsed options. (see build_parser)
     Returns:
-        sub_apertures : Sub-aperture image array.
+        tiling      : TilingPlan of the image.
     """
-    image = data[0]
-    depth = data[1]
-    
-    d, P_I, delta_d, L = cvt.convert_depth(depth, inputs['f'], inputs['g'],
-                                        inputs['P_D'], inputs['P_L'])
+    tiling = TilingPlan.from_lens_params(inputs, image_shape, MERGED_VIEWS, args.max_stride)
+    print('{} x {} tiles of {} pixels...'.format(len(tiling.row_origins), len(tiling.col_origins), tiling.tile))
 
-    EIA = pickup.generate_elemental_imgs_GPU(image, L, inputs['P_L'],
-                                             P_I, inputs['g'], inputs['num_of_lenses'])
+    backend = args.backend or ('gpu' if args.is_gpu else 'cpu')
+    estimate = estimate_pickup_memory(tiling.tile_shape, inputs['num_of_lenses'], inputs['P_L'],
+                                      backend, args.fill_method, tiling.grid[0] * tiling.grid[1])
+    check_memory_budget(estimate, args.memory_budget * MB if args.memory_budget else None)
+    return tiling
 
-    sub_apertures = sub.generate_sub_apertures(EIA, inputs['P_L'], inputs['num_of_lenses'])
-    sub_apertures = sub_apertures.astype(np.uint8)
-    sub_apertures = sub_apertures[7 * 400:, 7 * 400:]
-    return sub_apertures
 
+def pickup_views(image, depth, inputs, output_dir, args, pool, profiler=None, tiling=None, plan=None,
+                 views=None, tiles=None):
+    """Hierarchical integral imaging pickup of one image on a worker pool.
 
-def main():
-    # Set experiment name.
-    experiment_name = args.color_path.split('/')[-1].split('.')[0]
+    The tiles are read from, and the views written to, shared memory.
 
-    # Make directory for saving results.
-    output_dir = os.path.join(
-        args.output_path,
-        experiment_name
-    )
+    Args:
+        image      : RGB image.
+        depth      : Depth image.
+        inputs     : Parameter for integarl imaging pickup system.
+        output_dir : Output directory. (holds the '.npy' view stack)
+        args       : Parsed options. (see build_parser)
+        pool       : Pool of pickup workers. (see worker.worker_pool)
+        profiler   : Profiler recording the stages.
+        tiling     : TilingPlan of the image. (built and checked by 'plan_pickup' if None)
+        plan       : PickupPlan of the tile shape, reused across images and frames. (built if None)
+        views      : Merged views to update in place, reused across frames. (allocated if None)
+        tiles      : Indices of the tiles to pickup. (default: every tile)
+    Returns:
+        tiling     : TilingPlan of the image.
+        views      : SharedArray or MemmapArray of the merged views, to be passed to 'save_views'.
+    """
+    profiler = profiler or Profiler(enabled=False)
+
+    # Tile grid and merge layout of the hierarchical integral imaging pickup system.
+    if tiling is None:
+        tiling = plan_pickup(image.shape, inputs, args)
+    backend = args.backend or ('gpu' if args.is_gpu else 'cpu')
+
+    # The views are merged in shared memory, or straight in the '.npy' view stack on disk.
+    owned = views is None
+    if owned and 'npy' in args.output_format:
+        views = writers.MemmapArray.create(os.path.join(output_dir, writers.STACK_NAME),
+                                           tiling.stack_shape, np.uint8)
+    elif owned:
+        views = SharedArray.create(tiling.merged_shape, np.uint8)
+
+    if plan is None:
+        plan = PickupPlan.from_lens_params(inputs, tiling.tile_shape)
+    try:
+        with SharedArray.from_array(image) as shared_image, \
+                SharedArray.from_array(depth) as shared_depth:
+            func = partial(multiprocess_shared, inputs, tiling, (shared_image, shared_depth, views),
+                           backend=backend, fill_method=args.fill_method, plan=plan,
+                           memory_report=args.memory_report, profiler=profiler)
+            for events in pool.map(func, range(len(tiling)) if tiles is None else tiles):
+                profiler.extend(events)
+    except BaseException:
+        if not owned:
+            raise
+        # Release the views before re-raising.
+        with views:
+            raise
+    return tiling, views
+
+
+def save_views(tiling, views, output_dir, formats, profiler=None):
+    """Write the merged views and release their memory.
+
+    Args:
+        tiling     : TilingPlan of the image.
+        views      : Merged views returned by 'pickup_views'.
+        output_dir : Output directory.
+        formats    : Output formats. (see writers.FORMATS)
+        profiler   : Profiler recording the stages.
+    Returns:
+        paths      : Written file or directory of every format.
+    """
+    profiler = profiler or Profiler(enabled=False)
+    with views, profiler.stage('save', formats=formats, output=output_dir):
+        return writers.write_outputs(tiling, views.array, output_dir, formats)
+
+
+def save_profile(profiler, output_dir):
+    print(profiler.report())
+    profiler.save_json(os.path.join(output_dir, 'profile.json'))
+    profiler.save_chrome_trace(os.path.join(output_dir, 'trace.json'))
 
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir, exist_ok=True)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    # Make directory for saving results.
+    output_dir = os.path.join(args.output_path, experiment_name(args.color_path))
+    os.makedirs(output_dir, exist_ok=True)
 
     # Setup the micro lens parameters.
     inputs = get_lens_params()
+    profiler = Profiler(enabled=args.profile)
 
     # Load input RGB image and predict a depth image.
-    image = utils.load_image(args.color_path)
-    depth = get_depth_map(image, args.model_path)
-
-    # Divide image / depth for hierarchical integral imaging pickup system.
-    image_list = utils.divide_image(image)
-    depth_list = utils.divide_image(depth)
-    data_list = list(zip(image_list, depth_list))
-    
-    # Hierarchical integral imaging pickup system using multi-processing
+    image, depth = load_inputs(args.color_path, args, open_depth_cache(args), profiler)
+
+    # Tile grid and memory budget, checked before the workers start.
+    tiling = plan_pickup(image.shape, inputs, args)
+
+    # Hierarchical integral imaging pickup system using multi-processing.
     print('Integral imaging pickup system...')
-    multiprocessing.set_start_method('spawn')
-    pool = multiprocessing.Pool(processes=4)
-    func = partial(multiprocess_ini, inputs)
-    outputs = pool.map(func, data_list)
-    pool.close()
-    pool.join()
+    with worker_pool(processes=4) as pool:
+        tiling, views = pickup_views(image, depth, inputs, output_dir, args, pool, profiler, tiling=tiling)
 
-    # Merge large FOV sub-aperture images
-    large_sub_apertures = merge_sub_apertures(outputs, inputs['num_of_lenses'])
-    Image.fromarray(large_sub_apertures.astype(np.uint8)).save(output_dir + '/large_FOV_sub_apertures.jpg')
+    # The large FOV sub-aperture images are already merged in place.
+    print('Write large FOV sub-aperture images...')
+    save_views(tiling, views, output_dir, args.output_format, profiler)
 
+    if args.profile:
+        save_profile(profiler, output_dir)
 
-if __name__ == "__main__":
-    ##
-    gpus = tf.config.experimental.list_physical_devices('GPU')
-    if gpus:
-        try:
-            tf.config.experimental.set_virtual_device_configuration(
-                gpus[0],
-                [tf.config.experimental.VirtualDeviceConfiguration(memory_limit=3072)])
-        except RuntimeError as e:
-            print(e)
 
-    main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+""" Content-addressed on-disk cache of predicted depth maps (TensorFlow free) """
+
+import os
+import json
+import hashlib
+import numpy as np
+
+
+# Bump when the depth post-processing changes, to invalidate old entries.
+POSTPROCESS_VERSION = 1
+
+
+def file_digest(path, chunk_size=1 << 24):
+    """SHA-256 of a file, memoized next to it by (path, size, mtime).
+
+    Args:
+        path       : File path, or directory (e.g. exported SavedModel).
+        chunk_size : Read size.
+    Returns:
+        digest     : Hex digest.
+    """
+    if os.path.isdir(path):
+        sha = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith('.sha256.json'):
+                    continue
+                file_path = os.path.join(root, name)
+                sha.update(os.path.relpath(file_path, path).encode())
+                sha.update(file_digest(file_path, chunk_size).encode())
+        return sha.hexdigest()
+
+    stat = os.stat(path)
+    memo_path = path + '.sha256.json'
+    signature = [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+    try:
+        with open(memo_path) as f:
+            memo = json.load(f)
+        if memo['signature'] == signature:
+            return memo['digest']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+
+    try:
+        with open(memo_path, 'w') as f:
+            json.dump({'signature': signature, 'digest': digest}, f)
+    except OSError:
+        pass
+    return digest
+
+
+class DepthCache():
+    """Depth maps stored as .npy files, keyed by their inputs.
+
+    The key hashes the resized network input pixels, the model weights file
+    and the post-processing settings (output size and POSTPROCESS_VERSION).
+    Entries are read back memory-mapped. Reads refresh the file time, and
+    the least recently used entries are evicted above 'max_bytes'.
+
+    Args:
+        root      : Cache directory.
+        max_bytes : Size cap of the cache directory.
+    """
+    def __init__(self, root, max_bytes=2 << 30):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, color, weights_path, height, width):
+        sha = hashlib.sha256()
+        color = np.ascontiguousarray(color)
+        sha.update(str((color.shape, color.dtype.str)).encode())
+        sha.update(color.tobytes())
+        sha.update(file_digest(weights_path).encode())
+        sha.update(json.dumps({'height': height, 'width': width,
+                               'postprocess': POSTPROCESS_VERSION}).encode())
+        return sha.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.root, key + '.npy')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            depth = np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        return depth
+
+    def put(self, key, depth):
+        path = self.path(key)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.asarray(depth))
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if name.endswith('.npy'):
+                stat = os.stat(os.path.join(self.root, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.root, name))
+            total -= size
@@ -1,25 +1,19 @@
 import os
 import time
+import queue
+import threading
 import numpy as np
 import tensorflow as tf
 
 from PIL import Image
 from skimage.transform import resize
+from concurrent.futures import ThreadPoolExecutor
 
 from monodepth.model import MVAAutoEncoder
+from monodepth.preprocess import resize_image, preprocess_image
 
 
-def resize_image(color):
-    return np.asarray(Image.fromarray(color.copy()).resize((640, 480)))
-    
-    
-def preprocess_image(color):
-    # Normalize image. [0, 1]
-    normalized_color = color / 255.
-
-    # Expand dimension. (batch, height, width, channel)
-    net_input = np.expand_dims(normalized_color, axis=0)
-    return net_input
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
 
 
 def load_trained_model(weights_path):
@@ -29,13 +23,237 @@ def load_trained_model(weights_path):
     return model
 
 
+class TFLiteModel():
+    """TFLite depth model with the 'predict' interface of a Keras model."""
+    def __init__(self, path, num_threads=None):
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=num_threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+
+    def predict(self, net_input, batch_size=None):
+        preds = []
+        for x in np.asarray(net_input, dtype=np.float32):
+            if self.input['dtype'] != np.float32:
+                # Integer-only models: quantize the input.
+                scale, zero_point = self.input['quantization']
+                x = np.round(x / scale + zero_point).astype(self.input['dtype'])
+            self.interpreter.set_tensor(self.input['index'], x[None])
+            self.interpreter.invoke()
+
+            pred = self.interpreter.get_tensor(self.output['index']).astype(np.float32)
+            if self.output['dtype'] != np.float32:
+                scale, zero_point = self.output['quantization']
+                pred = (pred - zero_point) * scale
+            preds.append(pred[0])
+        return np.stack(preds)
+
+
+class SavedModel():
+    """Frozen SavedModel depth model with the 'predict' interface of a Keras model."""
+    def __init__(self, path):
+        self.model = tf.saved_model.load(path)
+        self.function = self.model.signatures['serving_default']
+        # Signature functions are called by keyword, older TensorFlow rejects positional
+        # arguments. ('x' for monodepth/export.py)
+        self.input_name = next(iter(self.function.structured_input_signature[1]))
+
+    def predict(self, net_input, batch_size=None):
+        outputs = self.function(**{self.input_name: tf.constant(np.asarray(net_input, dtype=np.float32))})
+        return next(iter(outputs.values())).numpy()
+
+
+class XLAModel():
+    """Keras depth model run through an XLA-compiled function."""
+    def __init__(self, model):
+        self.model = model
+        self.function = tf.function(lambda x: model(x, training=False), jit_compile=True)
+
+    def predict(self, net_input, batch_size=None):
+        return self.function(tf.constant(np.asarray(net_input, dtype=np.float32))).numpy()
+
+
+def load_model(model_path, xla=False):
+    """Load a depth model from trained weights or an exported artifact.
+
+    Args:
+        model_path : '.h5' trained weights, '.tflite' model or SavedModel directory.
+                     (see monodepth/export.py)
+        xla        : Compile the Keras model with XLA. ('.h5' only)
+    Returns:
+        model      : Object with a Keras-like 'predict' method.
+    """
+    if model_path.endswith('.tflite'):
+        return TFLiteModel(model_path)
+    if os.path.isdir(model_path):
+        return SavedModel(model_path)
+
+    model = load_trained_model(model_path)
+    return XLAModel(model) if xla else model
+
+
+def postprocess_depth(pred, height, width):
+    # Network output (inverse depth) to depth, resized to the input resolution.
+    return postprocess_depth_batch(pred, height, width)[0]
+
+
+def postprocess_depth_batch(preds, height, width):
+    # Same as postprocess_depth for a batch of predictions with one output size.
+    # The batch axis is neither interpolated nor smoothed by resize.
+    preds = preds.reshape((-1, 240, 320))
+    preds = np.clip((1000 / preds), 10, 1000)
+    preds = resize(preds, (len(preds), height, width), order=1, preserve_range=True, mode='reflect',
+                   anti_aliasing=True)
+    return preds
+
+
+def list_images(source):
+    # Image paths of a directory (sorted), or the given list of paths.
+    if isinstance(source, str) and os.path.isdir(source):
+        return [os.path.join(source, name) for name in sorted(os.listdir(source))
+                if name.lower().endswith(IMAGE_EXTENSIONS)]
+    if isinstance(source, str):
+        return [source]
+    return list(source)
+
+
+def load_network_input(path, loader=None):
+    # Decode an image, returns the network input (480x640, [0, 1]) and the image size.
+    color = loader(path) if loader is not None else np.asarray(Image.open(path).convert('RGB'))
+    height, width, _ = color.shape
+    if (height, width) != (480, 640):
+        color = resize_image(color)
+    return preprocess_image(color)[0].astype(np.float32), (height, width)
+
+
+def iter_input_batches(paths, batch_size=4, workers=4, prefetch=2, loader=None):
+    """Decode and resize images in parallel, a few batches ahead of the model.
+
+    Args:
+        paths      : Image paths.
+        batch_size : Number of images per batch.
+        workers    : Number of decoding threads.
+        prefetch   : Number of batches prepared ahead.
+        loader     : Function path -> RGB image. (default: PIL, native size)
+    Yields:
+        batch      : (paths, image sizes, network inputs (batch, 480, 640, 3))
+    """
+    batches = queue.Queue(maxsize=max(prefetch, 1))
+    done = object()
+
+    def produce():
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for start in range(0, len(paths), batch_size):
+                    chunk = paths[start:start + batch_size]
+                    loaded = list(executor.map(lambda path: load_network_input(path, loader), chunk))
+                    batches.put((chunk, [size for _, size in loaded], np.stack([x for x, _ in loaded])))
+        except Exception as e:
+            batches.put(e)
+        batches.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        batch = batches.get()
+        if batch is done:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        yield batch
+
+
+class DepthEstimator():
+    """Depth estimation model, loaded and warmed up once.
+
+    Args:
+        weights_path : Trained model file path, or exported artifact. (see load_model)
+        warmup       : Run a dummy inference right after loading, so that the
+                       first real call does not pay for graph tracing.
+        xla          : Compile the Keras model with XLA.
+    """
+    def __init__(self, weights_path, warmup=True, xla=False):
+        self.weights_path = weights_path
+
+        start = time.perf_counter()
+        self.model = load_model(weights_path, xla)
+        self.load_time = time.perf_counter() - start
+
+        self.warmup_time = 0.
+        if warmup:
+            start = time.perf_counter()
+            self.model.predict(np.zeros((1, 480, 640, 3), dtype=np.float32))
+            self.warmup_time = time.perf_counter() - start
+
+        self.latencies = []
+        print('Model loaded... ({:.2f} s, warm-up {:.2f} s)'.format(self.load_time, self.warmup_time))
+
+    def predict(self, net_input, height, width):
+        start = time.perf_counter()
+        pred = self.model.predict(net_input)
+        pred = postprocess_depth(pred, height, width)
+        self.latencies.append(time.perf_counter() - start)
+        return pred
+
+    def predict_batch(self, net_inputs, sizes):
+        start = time.perf_counter()
+        preds = self.model.predict(net_inputs, batch_size=len(net_inputs))
+
+        # Post-process every group of images sharing an output size at once.
+        depths = [None] * len(sizes)
+        for size in set(sizes):
+            group = [k for k, s in enumerate(sizes) if s == size]
+            for k, depth in zip(group, postprocess_depth_batch(preds[group], *size)):
+                depths[k] = depth
+
+        self.latencies.append(time.perf_counter() - start)
+        return depths
+
+    def stats(self):
+        return {
+            'load_time': self.load_time,
+            'warmup_time': self.warmup_time,
+            'calls': len(self.latencies),
+            'mean_latency': float(np.mean(self.latencies)) if self.latencies else 0.,
+            'latencies': list(self.latencies),
+        }
+
+
+# One estimator per weights file and process.
+_estimators = {}
+
+
+def get_estimator(weights_path):
+    key = os.path.abspath(weights_path)
+    if key not in _estimators:
+        _estimators[key] = DepthEstimator(weights_path)
+    return _estimators[key]
+
+
 def estimate_depth(net_input, height, width, weights_path):
-    model = load_trained_model(weights_path)
-    print('Model loaded...')
+    estimator = get_estimator(weights_path)
 
     print('Predict a depth image...')
-    pred = model.predict(net_input)
-    pred = pred.reshape((240, 320))
-    pred = np.clip((1000 / pred), 10, 1000)
-    pred = resize(pred, (height, width), order=1, preserve_range=True, mode='reflect', anti_aliasing=True)
-    return pred
\ No newline at end of file
+    pred = estimator.predict(net_input, height, width)
+    print('Depth predicted... ({:.2f} s)'.format(estimator.latencies[-1]))
+    return pred
+
+
+def estimate_depth_batch(source, weights_path, batch_size=4, workers=4, prefetch=2, loader=None):
+    """Estimate depth maps of many images.
+
+    Args:
+        source       : Directory or list of image paths.
+        weights_path : Trained model file path.
+        batch_size   : Number of images per inference.
+        workers      : Number of decoding threads.
+        prefetch     : Number of batches decoded ahead of the model.
+        loader       : Function path -> RGB image. (default: PIL, native size)
+    Yields:
+        path, depth  : Image path and its depth map, in input order.
+    """
+    estimator = get_estimator(weights_path)
+    paths = list_images(source)
+
+    for chunk, sizes, net_inputs in iter_input_batches(paths, batch_size, workers, prefetch, loader):
+        for path, depth in zip(chunk, estimator.predict_batch(net_inputs, sizes)):
+            yield path, depth
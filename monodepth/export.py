@@ -0,0 +1,88 @@
+""" Export the trained depth model to an optimized inference artifact
+
+    python -m monodepth.export --model_path ./monodepth/model.h5 \\
+        --format tflite --quantize float16 --output ./monodepth/model_fp16.tflite
+
+The artifact can be used anywhere a model file is expected (--model_path).
+"""
+
+import argparse
+import tensorflow as tf
+
+import monodepth.depth_estimator as estimator
+
+
+def representative_dataset(source, num_samples):
+    """Calibration inputs for full-integer quantization.
+
+    Args:
+        source      : Directory or list of calibration images.
+        num_samples : Maximum number of images.
+    Returns:
+        generator   : Function yielding [network input (1, 480, 640, 3)].
+    """
+    paths = estimator.list_images(source)[:num_samples]
+    if not paths:
+        raise ValueError('int8 quantization needs calibration images, none found in {}'.format(source))
+
+    def generator():
+        for _, _, net_inputs in estimator.iter_input_batches(paths, batch_size=1):
+            yield [net_inputs]
+    return generator
+
+
+def export_saved_model(model, output):
+    # Fixed 480x640 input signature, so that the graph is frozen at export time.
+    signature = tf.function(lambda x: {'depth': model(x, training=False)},
+                            input_signature=[tf.TensorSpec((None, 480, 640, 3), tf.float32)])
+    tf.saved_model.save(model, output, signatures={'serving_default': signature})
+
+
+def export_tflite(model, output, quantize='none', calibration=None, num_samples=100):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if quantize == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == 'dynamic':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif quantize == 'int8':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset(calibration, num_samples)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    with open(output, 'wb') as f:
+        f.write(converter.convert())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the depth estimation model.')
+    parser.add_argument('--model_path', type=str, default='./monodepth/model.h5',
+                        help='Trained model file.')
+    parser.add_argument('--format', type=str, default='tflite', choices=['saved_model', 'tflite'],
+                        help='Artifact format.')
+    parser.add_argument('--quantize', type=str, default='none',
+                        choices=['none', 'float16', 'dynamic', 'int8'],
+                        help='TFLite weight / activation quantization.')
+    parser.add_argument('--calibration', type=str, default='./inputs/',
+                        help='Calibration images for int8 quantization.')
+    parser.add_argument('--num_samples', type=int, default=100,
+                        help='Maximum number of calibration images.')
+    parser.add_argument('--output', type=str, required=True,
+                        help='Output file (.tflite) or directory (SavedModel).')
+    args = parser.parse_args()
+
+    model = estimator.load_trained_model(args.model_path)
+    print('Model loaded...')
+
+    if args.format == 'saved_model':
+        if args.quantize != 'none':
+            parser.error('--quantize is only supported with --format tflite')
+        export_saved_model(model, args.output)
+    else:
+        export_tflite(model, args.output, args.quantize, args.calibration, args.num_samples)
+    print('Exported to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+""" Input preprocessing of the depth estimation model (TensorFlow free) """
+
+import numpy as np
+
+from PIL import Image
+
+
+def resize_image(color):
+    return np.asarray(Image.fromarray(color.copy()).resize((640, 480)))
+
+
+def preprocess_image(color):
+    # Normalize image. [0, 1]
+    normalized_color = color / 255.
+
+    # Expand dimension. (batch, height, width, channel)
+    net_input = np.expand_dims(normalized_color, axis=0)
+    return net_input
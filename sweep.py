@@ -0,0 +1,250 @@
+""" Lens-parameter sweep of the large field-of-view integral imaging pickup system
+
+    python sweep.py --inputs ./inputs/ --num_of_lenses 300 400 --g 11 12 --output_path ./sweep/
+
+Every combination of the given lens parameters is picked up, for every
+input image. The depth of an image is predicted once and shared by all
+its configurations. Configurations with the same pickup geometry (number
+of lenses, lens size and object pixel size) share one TilingPlan and one
+PickupPlan. The configuration x tile jobs of an image all go to a single
+worker pool, at most '--max_configs' configurations at a time so that
+only their views are held in shared memory. Each configuration is written
+as soon as its last tile is done, to '<image>/<configuration>/'.
+
+'sweep.json' in the output directory indexes the configurations, their
+geometry and their outputs, or the error of the skipped and failed ones.
+"""
+
+import os
+import json
+import queue
+import itertools
+import numpy as np
+
+from functools import partial
+
+import main
+from batch import list_inputs
+import InIsystem.convert as cvt
+from InIsystem.plan import PickupPlan
+from InIsystem.shared import SharedArray
+from InIsystem.tiling import TilingPlan
+from InIsystem.profiler import Profiler
+from InIsystem.memory import MB, estimate_pickup_memory, check_memory_budget
+from InIsystem.worker import MERGED_VIEWS, worker_pool, multiprocess_shared, run_task
+
+
+# Swept lens parameters. (see main.get_lens_params)
+LENS_PARAMS = ['num_of_lenses', 'P_L', 'f', 'g', 'P_D']
+
+INDEX_NAME = 'sweep.json'
+
+
+def parse_args(argv=None):
+    parser = main.build_parser('Lens-parameter sweep of the integral imaging pickup.')
+    parser.add_argument('--inputs', type=str, required=True,
+                        help='Directory of images, manifest file of image paths, or a single image.')
+    defaults = main.get_lens_params()
+    parser.add_argument('--num_of_lenses', type=int, nargs='+', default=[defaults['num_of_lenses']],
+                        help='Numbers of lenses of lens array.')
+    parser.add_argument('--P_L', type=int, nargs='+', default=[defaults['P_L']],
+                        help='Sizes of elemental lens.')
+    parser.add_argument('--f', type=float, nargs='+', default=[defaults['f']],
+                        help='Focal lengths of elemental lens.')
+    parser.add_argument('--g', type=float, nargs='+', default=[defaults['g']],
+                        help='Gaps between lens and display.')
+    parser.add_argument('--P_D', type=float, nargs='+', default=[defaults['P_D']],
+                        help='Pixel pitches of LCD.')
+    parser.add_argument('--processes', type=int, default=4,
+                        help='Number of pickup workers.')
+    parser.add_argument('--max_configs', type=int, default=2,
+                        help='Configurations picked up at the same time, each holding its views in shared memory.')
+    args = parser.parse_args(argv)
+    if args.max_configs < 1:
+        parser.error('--max_configs must be at least 1')
+    return args
+
+
+def lens_grid(args):
+    """Every combination of the swept lens parameters, as main.get_lens_params() dictionaries."""
+    values = [getattr(args, name) for name in LENS_PARAMS]
+    return [dict(zip(LENS_PARAMS, combination)) for combination in itertools.product(*values)]
+
+
+def config_name(inputs):
+    return 'N{num_of_lenses}_PL{P_L}_f{f:g}_g{g:g}_PD{P_D:g}'.format(**inputs)
+
+
+def geometry_key(inputs):
+    """Parameters the tile grid and the pickup plan depend on: (num_of_lenses, P_L, P_I)."""
+    d = cvt.central_depth(inputs['f'], inputs['g'])
+    P_I = cvt.pixel_size_object_img(d, inputs['g'], inputs['P_D'])
+    return inputs['num_of_lenses'], inputs['P_L'], round(P_I, 9)
+
+
+def merged_views(P_L):
+    """MERGED_VIEWS, moved inside the lens when it has fewer views."""
+    rows, cols = MERGED_VIEWS
+    start = max(min(rows.start, P_L - len(rows)), 0)
+    views = range(start, min(start + len(rows), P_L))
+    return views, views
+
+
+class Geometry():
+    """Tile grid and pickup plan shared by the configurations of one geometry key.
+
+    Args:
+        inputs      : Lens parameters of any configuration of the group.
+        image_shape : (height, width[, 3]) of the input image.
+        max_stride  : Largest tile stride. (see TilingPlan)
+    """
+    def __init__(self, inputs, image_shape, max_stride=None):
+        self.tiling = TilingPlan.from_lens_params(inputs, image_shape, merged_views(inputs['P_L']), max_stride)
+        self.plan = PickupPlan.from_lens_params(inputs, self.tiling.tile_shape)
+
+
+def check_config(inputs):
+    if inputs['g'] <= inputs['f']:
+        raise ValueError('Gap g = {:g} must be larger than the focal length f = {:g}'.format(
+            inputs['g'], inputs['f']))
+
+
+def task_failed(results, key, error):
+    """Error callback of a tile job, routes the exception like a result."""
+    results.put((key, error))
+
+
+def sweep_image(path, configs, args, pool, cache=None, profiler=None, geometries=None):
+    """Pickup of one image with every lens configuration.
+
+    Args:
+        path       : Image path.
+        configs    : Lens parameters of each configuration. (see lens_grid)
+        args       : Parsed options. (see parse_args)
+        pool       : Pool of pickup workers. (see worker.worker_pool)
+        cache      : DepthCache.
+        profiler   : Profiler recording the stages.
+        geometries : {(image shape, geometry key): Geometry}, reused across images of the same size.
+    Returns:
+        entries    : Index entry of each configuration, with its 'outputs' or its 'error'.
+    """
+    profiler = profiler or Profiler(enabled=False)
+    geometries = {} if geometries is None else geometries
+    backend = args.backend or ('gpu' if args.is_gpu else 'cpu')
+    image_dir = os.path.join(args.output_path, main.experiment_name(path))
+
+    # One depth map for every configuration.
+    image, depth = main.load_inputs(path, args, cache, profiler)
+
+    entries, ready = [], []
+    for k, inputs in enumerate(configs):
+        name = config_name(inputs)
+        entry = {'image': path, 'config': name, 'lens_params': inputs,
+                 'output_dir': os.path.join(image_dir, name)}
+        entries.append(entry)
+        try:
+            check_config(inputs)
+            key = (image.shape[:2], geometry_key(inputs))
+            if key not in geometries:
+                geometries[key] = Geometry(inputs, image.shape, args.max_stride)
+            tiling, plan = geometries[key].tiling, geometries[key].plan
+
+            estimate = estimate_pickup_memory(tiling.tile_shape, inputs['num_of_lenses'], inputs['P_L'],
+                                              backend, args.fill_method, tiling.grid[0] * tiling.grid[1])
+            check_memory_budget(estimate, args.memory_budget * MB if args.memory_budget else None)
+        except (ValueError, MemoryError) as e:
+            entry['error'] = str(e)
+            print('Skip {}: {}'.format(name, e))
+            continue
+
+        entry.update({'P_I': geometry_key(inputs)[2], 'tile': tiling.tile, 'tiles': len(tiling),
+                      'view_grid': [int(n) for n in tiling.grid],
+                      'view_shape': [int(n) for n in tiling.view_shape]})
+        func = partial(multiprocess_shared, inputs, tiling,
+                       backend=backend, fill_method=args.fill_method, plan=plan,
+                       memory_report=args.memory_report, profiler=profiler)
+        ready.append((k, tiling, func))
+
+    print('Integral imaging pickup of {}: {} configurations, {} tile jobs...'.format(
+        path, len(ready), sum(len(tiling) for _, tiling, _ in ready)))
+
+    # (key, events) of the finished tile jobs, (key, exception) of the failed ones.
+    results = queue.Queue()
+    in_flight = {}
+    try:
+        with SharedArray.from_array(image) as shared_image, SharedArray.from_array(depth) as shared_depth:
+            queued = iter(ready)
+            while True:
+                # The views of a configuration are only allocated once it is submitted.
+                for k, tiling, func in itertools.islice(queued, args.max_configs - len(in_flight)):
+                    views = SharedArray.create(tiling.merged_shape, np.uint8)
+                    in_flight[k] = [tiling, views, len(tiling)]
+                    job = partial(func, (shared_image, shared_depth, views))
+                    for index in range(len(tiling)):
+                        pool.apply_async(run_task, ((k, job, index),), callback=results.put,
+                                         error_callback=partial(task_failed, results, k))
+                if not in_flight:
+                    break
+
+                k, out = results.get()
+                in_flight[k][2] -= 1
+                if isinstance(out, Exception):
+                    # A failed tile fails its configuration only, the sweep goes on.
+                    if 'error' not in entries[k]:
+                        entries[k]['error'] = '{}: {}'.format(type(out).__name__, out)
+                        print('Failed {}: {}'.format(entries[k]['config'], entries[k]['error']))
+                else:
+                    profiler.extend(out)
+                if in_flight[k][2]:
+                    continue
+
+                if 'error' in entries[k]:
+                    # Its other tiles were already queued, the views are dropped once they are done.
+                    _, views, _ = in_flight.pop(k)
+                    views.unlink()
+                    continue
+
+                # Last tile of the configuration: write it and free its views.
+                os.makedirs(entries[k]['output_dir'], exist_ok=True)
+                tiling, views, _ = in_flight.pop(k)
+                entries[k]['outputs'] = main.save_views(tiling, views, entries[k]['output_dir'],
+                                                        args.output_format, profiler)
+                print('Written {}'.format(entries[k]['output_dir']))
+    finally:
+        for _, views, _ in in_flight.values():
+            views.unlink()
+    return entries
+
+
+def write_index(entries, output_path):
+    with open(os.path.join(output_path, INDEX_NAME), 'w') as f:
+        json.dump({'lens_params': LENS_PARAMS, 'results': entries}, f, indent=2)
+
+
+def sweep(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.output_path, exist_ok=True)
+
+    configs = lens_grid(args)
+    paths = list_inputs(args.inputs)
+    print('{} configurations x {} images...'.format(len(configs), len(paths)))
+
+    cache = main.open_depth_cache(args)
+    profiler = Profiler(enabled=args.profile)
+    geometries = {}
+    entries = []
+    with worker_pool(processes=args.processes) as pool:
+        for path in paths:
+            entries.extend(sweep_image(path, configs, args, pool, cache, profiler, geometries))
+            # Rewritten after every image, so an interrupted sweep keeps its index.
+            write_index(entries, args.output_path)
+
+    done = sum('outputs' in entry for entry in entries)
+    print('{} / {} configurations written, index {}'.format(
+        done, len(entries), os.path.join(args.output_path, INDEX_NAME)))
+    if args.profile:
+        main.save_profile(profiler, args.output_path)
+
+
+if __name__ == '__main__':
+    sweep()
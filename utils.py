@@ -1,19 +1,21 @@
+import cv2
 import numpy as np
 
 from PIL import Image
 
 
-def load_image(path):
+def load_image(path, size=(1200, 700)):
     """Load image data.
 
     Args:
         path : Image path.
+        size : (width, height) the image is resized to. None keeps the native size.
     Returns:
         img  : Numpy array. (image)
     """
-    # In this system, the input image need to have resolution (480, 854).
-    # if color height != 700 and color width != 1200, Resize the input image.
-    img = Image.open(path).resize((1200, 700))
+    img = Image.open(path).convert('RGB')
+    if size is not None:
+        img = img.resize(size)
     img = np.asarray(img)
     return img
 
@@ -29,24 +31,38 @@ def save_image(img, path):
     img.save(path)
 
 
-def divide_image(image):
+def divide_image(image, tiling):
     """Divide image for hierarchiclar integral imaging pickup system.
 
     Args:
         image      : Numpy array. (image)
+        tiling     : TilingPlan of the image. (see InIsystem.tiling)
     Returns:
         image_list : Partitioned image list.
     """
-    width_list = [i * 200 for i in range(4)]
-    height_list = [0, 100]
-
     image_list = []
-    for h in height_list:
-        for w in width_list:
-            image_list.append(image[h:h + 600, w:w + 600])
+    for index in range(len(tiling)):
+        rows, cols = tiling.tile_slices(index)
+        image_list.append(image[rows, cols])
     return image_list
 
 
+def hole_mask(image):
+    """Find the pickup holes of an image.
+
+    Same rule as the inpainting masks: pixels whose gray level is <= 1.
+
+    Args:
+        image : Numpy array. (RGB uint8 image or stack of images, (..., height, width, 3))
+    Returns:
+        mask  : Boolean hole mask, (..., height, width).
+    """
+    flat = np.ascontiguousarray(image).reshape(-1, image.shape[-2], 3)
+    gray = cv2.cvtColor(flat, cv2.COLOR_RGB2GRAY)
+    mask = gray.reshape(image.shape[:-1]) <= 1
+    return mask
+
+
 def visualize_depth(depth):
     """Visualize raw depth image.
 
@@ -0,0 +1,270 @@
+""" Video / frame-sequence mode of the large field-of-view integral imaging pickup system
+
+    python video.py --video ./inputs/clip.mp4 --output_path ./results/
+    python video.py --video './inputs/frames/%05d.png' --output_path ./results/
+
+Frames are streamed one at a time from a video file, a directory of images
+or a numbered image sequence. The depth model, the lens geometry, the tile
+grid, the pickup plan and the worker pool are set up once and reused by
+every frame:
+    - a frame identical to the previous one reuses its depth map.
+    - a tile whose color and depth are unchanged keeps its views from the
+      previous frame, only the changed tiles go through the pickup.
+Depth inference of frame N+1 runs in a thread while frame N is picked up.
+The views of every frame are written to '<name>/frame_000000', ... as soon
+as the frame is done.
+"""
+
+import os
+import re
+import glob
+import queue
+import hashlib
+import threading
+import numpy as np
+import cv2
+
+import main
+import utils
+from batch import IMAGE_EXTENSIONS, list_inputs
+import InIsystem.writers as writers
+from InIsystem.plan import PickupPlan
+from InIsystem.shared import SharedArray
+from InIsystem.worker import worker_pool
+from InIsystem.profiler import Profiler
+
+
+# Marks the end of the frames in a queue.
+_DONE = object()
+
+
+def parse_args(argv=None):
+    parser = main.build_parser('Integral imaging pickup of a video or an image sequence.')
+    parser.add_argument('--video', type=str, required=True,
+                        help="Video file, directory of frames, or numbered sequence ('frames/%%05d.png' or a glob).")
+    parser.add_argument('--start', type=int, default=0,
+                        help='Index of the first frame.')
+    parser.add_argument('--max_frames', type=int, default=None,
+                        help='Number of frames to process. (default: all)')
+    parser.add_argument('--depth_step', type=float, default=0.,
+                        help='Depth quantization step of the tile hashes. (0: a tile is reused only if bit-identical)')
+    parser.add_argument('--queue_size', type=int, default=1,
+                        help='Frames waiting between depth inference and pickup.')
+    parser.add_argument('--processes', type=int, default=4,
+                        help='Number of pickup workers.')
+    return parser.parse_args(argv)
+
+
+def frame_order(path):
+    """Sort key of frame names, comparing their digit runs as numbers. ('f_2' < 'f_10')"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', os.path.basename(path))]
+
+
+def list_sequence(pattern):
+    """Frames of a printf-style numbered sequence, e.g. 'frames/%05d.png', in frame number order.
+
+    Only the names matching the pattern are kept, with any number of digits.
+    """
+    directory, name = os.path.split(pattern)
+    parts = re.split(r'%0?\d*d', name)
+    if len(parts) != 2:
+        raise ValueError('Frame sequence {} needs exactly one %d field in its file name'.format(pattern))
+    regex = re.compile(re.escape(parts[0]) + r'(\d+)' + re.escape(parts[1]) + '$')
+
+    frames = []
+    for entry in os.listdir(directory or '.'):
+        match = regex.match(entry)
+        if match:
+            frames.append((int(match.group(1)), os.path.join(directory, entry)))
+    return [path for _, path in sorted(frames)]
+
+
+def list_frames(source):
+    """Frame paths of a directory or of a numbered sequence, in frame order. None for a video file."""
+    if os.path.isdir(source):
+        return sorted(list_inputs(source), key=frame_order)
+    if '%' in source:
+        return list_sequence(source)
+    if any(c in source for c in '*?['):
+        return sorted(glob.glob(source), key=frame_order)
+    if source.lower().endswith(IMAGE_EXTENSIONS):
+        return [source]
+    return None
+
+
+def iter_frames(source, size=(1200, 700), start=0, max_frames=None):
+    """Read the frames one at a time.
+
+    Args:
+        source     : Video file, directory of frames or numbered sequence. (see list_frames)
+        size       : (width, height) the frames are resized to. None keeps the native size.
+        start      : Index of the first frame.
+        max_frames : Number of frames to read. (default: all)
+    Yields:
+        index, img : Frame index and RGB frame.
+    """
+    stop = None if max_frames is None else start + max_frames
+    paths = list_frames(source)
+    if paths is not None:
+        for index, path in enumerate(paths[start:stop], start):
+            yield index, utils.load_image(path, size)
+        return
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError('Cannot open video {}'.format(source))
+    try:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        index = start
+        while stop is None or index < stop:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            if size is not None and (frame.shape[1], frame.shape[0]) != tuple(size):
+                frame = cv2.resize(frame, tuple(size), interpolation=cv2.INTER_CUBIC)
+            yield index, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def frame_digest(image):
+    sha = hashlib.sha256(str(image.shape).encode())
+    sha.update(np.ascontiguousarray(image).data)
+    return sha.hexdigest()
+
+
+def tile_digests(image, depth, tiling, depth_step=0.):
+    """Fingerprint of the color and depth of every tile.
+
+    Args:
+        image      : RGB image.
+        depth      : Depth image.
+        tiling     : TilingPlan of the image.
+        depth_step : Depth quantization step, so that the small changes of a
+                     re-predicted depth map keep the tile. (0: exact bytes)
+    Returns:
+        digests    : One hex digest per tile, row by row.
+    """
+    digests = []
+    for color_tile, depth_tile in zip(utils.divide_image(image, tiling), utils.divide_image(depth, tiling)):
+        if depth_step:
+            depth_tile = np.round(depth_tile / depth_step).astype(np.int64)
+        sha = hashlib.sha256(np.ascontiguousarray(color_tile).data)
+        sha.update(np.ascontiguousarray(depth_tile).data)
+        digests.append(sha.hexdigest())
+    return digests
+
+
+def video_name(source):
+    """Experiment name of a video, of a frame directory, or of the directory of a numbered sequence."""
+    source = source.rstrip('/')
+    if any(c in os.path.basename(source) for c in '%*?['):
+        source = os.path.dirname(source)
+    return main.experiment_name(source)
+
+
+def frame_name(index):
+    return 'frame_{:06d}'.format(index)
+
+
+def run_depth(frames, args, cache, profiler, sink, errors):
+    """Predict the depth of every frame and put (index, image, depth) in 'sink'.
+
+    A frame identical to the previous one reuses its depth without inference.
+    """
+    previous = None
+    try:
+        for index, image in frames:
+            key = frame_digest(image)
+            if previous is not None and previous[0] == key:
+                depth = previous[1]
+            else:
+                with profiler.stage('depth_inference', frame=index):
+                    depth = main.get_depth_map(image, args.model_path, cache)
+            previous = (key, depth)
+            sink.put((index, image, depth))
+    except Exception as e:
+        errors.append(e)
+    finally:
+        sink.put(_DONE)
+
+
+def run_video(args):
+    """Run the streaming pickup of every frame.
+
+    Args:
+        args : Parsed options. (see parse_args)
+    Returns:
+        done : Number of frames written.
+    """
+    output_dir = os.path.join(args.output_path, video_name(args.video))
+    os.makedirs(output_dir, exist_ok=True)
+
+    inputs = main.get_lens_params()
+    cache = main.open_depth_cache(args)
+    profiler = Profiler(enabled=args.profile)
+    frames = iter_frames(args.video, None if args.native_size else (1200, 700), args.start, args.max_frames)
+
+    frame_queue = queue.Queue(maxsize=args.queue_size)
+    errors = []
+    thread = threading.Thread(target=run_depth, args=(frames, args, cache, profiler, frame_queue, errors),
+                              daemon=True)
+    thread.start()
+
+    # The tile grid and the memory budget come from the first frame, before the workers start.
+    item = frame_queue.get()
+    views, digests = None, None
+    done = 0
+    try:
+        if item is not _DONE:
+            tiling = main.plan_pickup(item[1].shape, inputs, args)
+            plan = PickupPlan.from_lens_params(inputs, tiling.tile_shape)
+            # Kept across frames: the unchanged tiles keep the views of the previous frame.
+            views = SharedArray.create(tiling.merged_shape, np.uint8)
+
+        with worker_pool(processes=args.processes) as pool:
+            while item is not _DONE:
+                index, image, depth = item
+                if image.shape[:2] != (tiling.height, tiling.width):
+                    raise ValueError('Frame {} is {} x {}, the video started at {} x {}'.format(
+                        index, image.shape[1], image.shape[0], tiling.width, tiling.height))
+
+                with profiler.stage('tile_digests', frame=index):
+                    current = tile_digests(image, depth, tiling, args.depth_step)
+                changed = [i for i in range(len(tiling)) if digests is None or current[i] != digests[i]]
+                digests = current
+
+                if changed:
+                    main.pickup_views(image, depth, inputs, output_dir, args, pool, profiler,
+                                      tiling=tiling, plan=plan, views=views, tiles=changed)
+
+                frame_dir = os.path.join(output_dir, frame_name(index))
+                os.makedirs(frame_dir, exist_ok=True)
+                with profiler.stage('save', frame=index, formats=args.output_format):
+                    writers.write_outputs(tiling, views.array, frame_dir, args.output_format)
+                done += 1
+                print('Frame {}: {} / {} tiles picked up, written to {}'.format(
+                    index, len(changed), len(tiling), frame_dir))
+                item = frame_queue.get()
+    finally:
+        if views is not None:
+            views.unlink()
+    thread.join()
+    if errors:
+        raise errors[0]
+
+    if args.profile:
+        main.save_profile(profiler, output_dir)
+    return done
+
+
+def video(argv=None):
+    args = parse_args(argv)
+    done = run_video(args)
+    print('{} frames written.'.format(done))
+
+
+if __name__ == '__main__':
+    video()